@@ -1,5 +1,6 @@
 import sys, os, json, timestamp_manager
 from binary_functions import *
+from file_writer import file_writer
 from pathlib import Path
 
 def decode_box_data(box_data, version):
@@ -97,41 +98,45 @@ def separate_data_v4(box_matrix_data):
 
     return (box_data, matrix_data)
 
-def decode(encoded_file_path, version, timestamp_manager):
-    print(f"Decoding {encoded_file_path}")
-
-    encoded_file = open(encoded_file_path, 'rb')
-    encoded_data = encoded_file.read()
-    encoded_file.close()
+def identify_file_type(file_path, version):
+    if version == '4':
+        return "combined"
+    elif "BOXD." in file_path.name:
+        return "box"
+    elif "BOXM." in file_path.name:
+        return "matrix"
+    
+    return ""
 
+def decode_data(encoded_data, version, file_type):
     decoded_data = {}
-    file_type = ""
-
-    if version == '4':
-        file_type = "combined"
 
+    if file_type == "combined":
         (encoded_box_data, encoded_matrix_data) = separate_data_v4(encoded_data)
         decoded_data["boxes"] = decode_box_data(encoded_box_data, version)
         decoded_data["matrices"] = decode_matrix_data(encoded_matrix_data)
 
-    elif version == '5':
-        if encoded_file_path.name.endswith("BOXD.dmp"):
-            file_type = "box"
-            decoded_data = decode_box_data(encoded_data[8:], version)
+    elif file_type == "box":
+        decoded_data = decode_box_data(encoded_data[8:], version)
 
-        elif encoded_file_path.name.endswith("BOXM.dmp"):
-            file_type = "matrix"
-            decoded_data = decode_matrix_data(encoded_data[8:])
+    elif file_type == "matrix":
+        decoded_data = decode_matrix_data(encoded_data[8:])
+    
+    return decoded_data
 
+def decode(encoded_file_path, version, timestamp_manager):
+    print(f"Decoding {encoded_file_path}")
 
-    decoded_file_path = Path(encoded_file_path.parent, encoded_file_path.name.replace(".dmp", ".json"))
+    encoded_file = open(encoded_file_path, 'rb')
+    encoded_data = encoded_file.read()
+    encoded_file.close()
 
-    decoded_file = open(decoded_file_path, 'w')
-    decoded_file.write(json.dumps(decoded_data, indent=4))
-    decoded_file.close()
+    decoded_data = decode_data(encoded_data, version, identify_file_type(encoded_file_path, version))
 
-    if timestamp_manager != []:
-        timestamp_manager.add_timestamp(decoded_file_path)
+
+    decoded_file_path = Path(encoded_file_path.parent, encoded_file_path.name.replace(".dmp", ".json"))
+
+    file_writer.save_text(json.dumps(decoded_data, indent=4), decoded_file_path, timestamp_manager)
 
 
 def encode_box_data(boxes, version):
@@ -200,17 +205,10 @@ def encode_matrix_data(matrices):
     
     return matrix_data
 
-def encode(decoded_file_path, version, timestamp_manager):
-    print(f"Encoding {decoded_file_path}")
-
-    decoded_file = open(decoded_file_path, 'r')
-    decoded_data = json.loads(decoded_file.read())
-    decoded_file.close()
-
+def encode_data(decoded_data, version, file_type):
     encoded_data = []
-    file_type = ""
 
-    if version == '4':
+    if file_type == "combined":
         encoded_box_data = encode_box_data(decoded_data["boxes"], version)
         encoded_matrix_data = encode_matrix_data(decoded_data["matrices"])
 
@@ -218,24 +216,32 @@ def encode(decoded_file_path, version, timestamp_manager):
         encoded_data_length = 6 + len(encoded_box_data) + len(encoded_matrix_data)
 
         encoded_data = le_encode(encoded_data_length, 4) + header + encoded_box_data + encoded_matrix_data
-        file_type = "combined"
 
-    elif version == '5':
+    else:
         header = []
 
-        if decoded_file_path.name.endswith("BOXD.json"):
-            file_type = "box"
+        if file_type == "box":
             encoded_data = encode_box_data(decoded_data, version)
             header = [0x42, 0x4f, 0x58, 0x44]
 
-        elif decoded_file_path.name.endswith("BOXM.json"):
-            file_type = "matrix"
+        elif file_type == "matrix":
             encoded_data = encode_matrix_data(decoded_data)
             header = [0x42, 0x4f, 0x58, 0x4d]
 
         encoded_data_length = 8 + len(encoded_data)
         encoded_data = header + be_encode(encoded_data_length, 4) + encoded_data
     
+    return encoded_data
+
+def encode(decoded_file_path, version, timestamp_manager):
+    print(f"Encoding {decoded_file_path}")
+
+    decoded_file = open(decoded_file_path, 'r')
+    decoded_data = json.loads(decoded_file.read())
+    decoded_file.close()
+
+    encoded_data = encode_data(decoded_data, version, identify_file_type(decoded_file_path, version))
+    
     encoded_file_path = Path(decoded_file_path.parent, decoded_file_path.name.replace(".json", ".dmp"))
     encoded_file = open(encoded_file_path, 'wb')
     encoded_file.write(bytes(encoded_data))
@@ -244,6 +250,43 @@ def encode(decoded_file_path, version, timestamp_manager):
     if timestamp_manager != []:
         timestamp_manager.add_timestamp(decoded_file_path)
 
+def verify(encoded_file_path, version):
+    encoded_file = open(encoded_file_path, 'rb')
+    encoded_data = encoded_file.read()
+    encoded_file.close()
+
+    file_type = identify_file_type(encoded_file_path, version)
+
+    # the decoded data goes through json first, the same as it would on disk
+    decoded_data = json.loads(json.dumps(decode_data(encoded_data, version, file_type)))
+    reencoded_data = json.loads(json.dumps(decode_data(bytes(encode_data(decoded_data, version, file_type)), version, file_type)))
+
+    if reencoded_data == decoded_data:
+        return []
+    
+    sections = {file_type: decoded_data}
+    reencoded_sections = {file_type: reencoded_data}
+
+    if file_type == "combined":
+        sections = decoded_data
+        reencoded_sections = reencoded_data
+    
+    mismatches = []
+
+    for section in sections:
+        entries = sections[section]
+        reencoded_entries = reencoded_sections[section]
+
+        if len(reencoded_entries) != len(entries):
+            mismatches.append(f"{len(entries)} {section} entries became {len(reencoded_entries)}")
+            continue
+
+        for i in range(len(entries)):
+            if reencoded_entries[i] != entries[i]:
+                mismatches.append(f"{section} entry {i}")
+    
+    return mismatches
+
 if __name__ == "__main__":
     if sys.argv[1] == 'decode':
         decode(Path(sys.argv[2]).resolve(), sys.argv[3], [])
@@ -1,5 +1,7 @@
-import sys, os, json, math, re, timestamp_manager, palette_codec, image_codec
+import sys, os, json, math, re, hashlib, timestamp_manager, palette_codec, image_codec
 from binary_functions import *
+from file_writer import file_writer
+from size_report import size_report
 from PIL import Image
 from pathlib import Path
 
@@ -30,35 +32,35 @@ def find_lowest_offset(offset_table):
     return lowest_offset
 
 def get_ordered_offsets(offset_table):
-    ordered_offsets = []
+    ordered_offsets = set()
 
-    for i in range(len(offset_table)):
-        offset = offset_table[i]
+    for offset in offset_table:
+        if offset > 2:
+            ordered_offsets.add(offset)
+    
+    return sorted(ordered_offsets)
 
-        if offset <= 2:
-            continue
-        
-        if offset in ordered_offsets:
-            continue
-        
-        j = 0
-        while j < len(ordered_offsets):
-            if offset < ordered_offsets[j]:
-                break
+def get_next_offset_map(ordered_offsets, end_offset):
+    # maps each chunk's offset to where the following chunk starts, so its end is a single lookup
+    next_offset_map = {}
 
-            j += 1
-        
-        ordered_offsets.insert(j, offset)
+    for i in range(len(ordered_offsets) - 1):
+        next_offset_map[ordered_offsets[i]] = ordered_offsets[i + 1]
+    
+    if len(ordered_offsets) > 0:
+        next_offset_map[ordered_offsets[-1]] = end_offset
     
-    return ordered_offsets
+    return next_offset_map
 
 def encode_offset_table(chunks, start_offset, index_map, use_chunks_end_for_null_pointer):
+    chunk_offsets = [start_offset]
+    for chunk in chunks:
+        chunk_offsets.append(chunk_offsets[-1] + len(chunk))
+
     null_pointer = 0
 
     if use_chunks_end_for_null_pointer:
-        null_pointer = start_offset
-        for chunk in chunks:
-            null_pointer += len(chunk)
+        null_pointer = chunk_offsets[-1]
 
     encoded_offset_table = []
 
@@ -66,30 +68,10 @@ def encode_offset_table(chunks, start_offset, index_map, use_chunks_end_for_null
         if entry == -1:
             encoded_offset_table += le_encode(null_pointer, 2)
         else:
-            offset = start_offset
-            for i in range(entry):
-                offset += len(chunks[i])
-            
-            encoded_offset_table += le_encode(offset, 2)
+            encoded_offset_table += le_encode(chunk_offsets[entry], 2)
     
     return encoded_offset_table
 
-def get_palette_index_prioritising_global_colors(color, palette):
-    i = 0xc0
-    while i < len(palette):
-        if palette[i][0] == color[0] and palette[i][1] == color[1] and palette[i][2] == color[2]:
-            return i
-        i += 1
-    
-    i = 0
-    while i < len(palette):
-        if palette[i][0] == color[0] and palette[i][1] == color[1] and palette[i][2] == color[2]:
-            return i
-        i += 1
-    
-    print("Error: Color not in palette")
-    exit()
-
 class Pict:
     image = []
 
@@ -154,10 +136,7 @@ class Pict:
     
     def decode_image(self, palette):
         p = 0
-        x = 0
-        y = 0
-
-        self.image = Image.new(mode = "RGB", size = (self.width, self.height))
+        i = 0
 
         color_mask = 0xf0
         color_shift = 4
@@ -168,7 +147,11 @@ class Pict:
             color_shift = 3
             repeat_mask = 0x07
 
-        while x < self.width and p < len(self.image_data):
+        # runs go down each column in turn, and whatever the data doesn't reach is left as color 0
+        pixel_count = self.width * self.height
+        pixels = bytearray(pixel_count)
+
+        while i < pixel_count and p < len(self.image_data):
             byte = self.image_data[p]
             p += 1
 
@@ -178,35 +161,25 @@ class Pict:
             if repeat == 0:
                 repeat = self.image_data[p]
                 p += 1
-            
-            for i in range(repeat):
-                self.image.putpixel((x, y), palette[color])
-
-                y += 1
-                if y == self.height:
-                    y = 0
-                    x += 1
 
-                    if x == self.width:
-                        break
+            run_end = min(i + repeat, pixel_count)
+            pixels[i:run_end] = bytes((color,)) * (run_end - i)
+            i = run_end
 
-        while x < self.width:
-            self.image.putpixel((x, y), palette[0])
-            y += 1
-            if y == self.height:
-                y = 0
-                x += 1
+        self.image = Image.frombytes("P", (self.height, self.width), bytes(pixels))
+        self.image = self.image.transpose(Image.Transpose.TRANSPOSE)
+        self.image.putpalette(image_codec.flatten_palette(palette))
 
 
     def encode(self, palette, allow_redirectable_picts):
-        encoded_pict = []
+        encoded_pict = bytearray()
 
-        encoded_pict += le_encode(self.width, 2)
-        encoded_pict += le_encode(self.height, 2)
-        encoded_pict += le_encode(signed_encode(self.relative_x), 2)
-        encoded_pict += le_encode(signed_encode(self.relative_y), 2)
-        encoded_pict += le_encode(signed_encode(self.move_x), 2)
-        encoded_pict += le_encode(signed_encode(self.move_y), 2)
+        encoded_pict += bytes(le_encode(self.width, 2))
+        encoded_pict += bytes(le_encode(self.height, 2))
+        encoded_pict += bytes(le_encode(signed_encode(self.relative_x), 2))
+        encoded_pict += bytes(le_encode(signed_encode(self.relative_y), 2))
+        encoded_pict += bytes(le_encode(signed_encode(self.move_x), 2))
+        encoded_pict += bytes(le_encode(signed_encode(self.move_y), 2))
 
         if allow_redirectable_picts:
             encoded_pict.append(self.redirect_limb)
@@ -219,33 +192,22 @@ class Pict:
             color_shift = 3
             repeat_mask = 0x07
 
-        x = 0
-        y = 0
+        # runs carry on from the bottom of one column to the top of the next
+        pixels = image_codec.get_column_major_indices(self.image, palette, (self.spritesheet_x, self.spritesheet_y))
 
-        while x < self.width:
-            repeat_count = 0
-            repeating_color = self.image.getpixel((x, y))
-            
-            while x < self.width and repeat_count < 0xff:
-                color = self.image.getpixel((x, y))
-
-                if color != repeating_color:
-                    break
-                else:
-                    repeat_count += 1
+        for run in image_codec.run_pattern.finditer(pixels):
+            color_byte = pixels[run.start()] << color_shift
+            run_length = run.end() - run.start()
 
-                    y += 1
-                    if y >= self.height:
-                        y = 0
-                        x += 1
-            
-            palette_index = image_codec.get_palette_index(repeating_color, palette)
+            while run_length > 0:
+                repeat_count = min(run_length, 0xff)
+                run_length -= repeat_count
 
-            if repeat_count > repeat_mask:
-                encoded_pict.append(palette_index << color_shift)
-                encoded_pict.append(repeat_count)
-            else:
-                encoded_pict.append((palette_index << color_shift) | repeat_count)
+                if repeat_count > repeat_mask:
+                    encoded_pict.append(color_byte)
+                    encoded_pict.append(repeat_count)
+                else:
+                    encoded_pict.append(color_byte | repeat_count)
 
         return encoded_pict
 
@@ -460,6 +422,59 @@ class Settings:
         self.mirror_west_anims = serialised_settings["Mirror west anims"]
         self.allow_redirectable_picts = serialised_settings["Allow redirectable picts"]
 
+class PictCache:
+    # remembers each pict's encoded bytes between builds, so only frames that were edited get encoded again
+    entries = {}
+    used_entries = {}
+
+    def __init__(self):
+        self.entries = {}
+        self.used_entries = {}
+
+    def get_key(self, pict, palette, allow_redirectable_picts):
+        header_fields = [pict.width, pict.height, pict.relative_x, pict.relative_y, pict.move_x, pict.move_y, pict.redirect_limb, pict.redirect_pict, allow_redirectable_picts, pict.image.mode]
+
+        pict_hash = hashlib.blake2b(digest_size=16)
+        pict_hash.update(json.dumps(header_fields).encode())
+        pict_hash.update(bytes(image_codec.flatten_palette(palette)))
+        pict_hash.update(pict.image.tobytes())
+
+        return pict_hash.hexdigest()
+
+    def get(self, key):
+        if not key in self.entries:
+            return None
+        
+        encoded_pict = self.entries[key]
+        self.used_entries[key] = encoded_pict
+
+        return encoded_pict
+
+    def add(self, key, encoded_pict):
+        self.entries[key] = bytes(encoded_pict)
+        self.used_entries[key] = self.entries[key]
+
+    def load(self, cache_path):
+        if not cache_path.is_file():
+            return
+        
+        cache_file = open(cache_path, 'r')
+        serialised_entries = json.loads(cache_file.read())
+        cache_file.close()
+
+        for key in serialised_entries:
+            self.entries[key] = bytes.fromhex(serialised_entries[key])
+
+    def save(self, cache_path):
+        # only the picts of this build are kept, so frames that were replaced don't pile up
+        serialised_entries = {}
+        for key in self.used_entries:
+            serialised_entries[key] = self.used_entries[key].hex()
+
+        cache_file = open(cache_path, 'w')
+        cache_file.write(json.dumps(serialised_entries, indent = 0))
+        cache_file.close()
+
 class Costume:
     settings = []
     commands = []
@@ -474,6 +489,8 @@ class Costume:
 
     palette = []
 
+    pict_cache = None
+
 
     def __init__(self):
         self.settings = []
@@ -488,6 +505,8 @@ class Costume:
         self.picts = []
 
         self.palette = []
+
+        self.pict_cache = None
         
     def decode(self, encoded_costume, version, room_palette):
         base_offset = 0
@@ -505,7 +524,7 @@ class Costume:
         palette_map = encoded_costume[p:p + self.settings.palette_size]
         p += self.settings.palette_size
 
-        self.palette = []
+        self.palette = palette_codec.Palette()
         for i in range(len(palette_map)):
             self.palette.append(room_palette[palette_map[i]])
 
@@ -548,7 +567,7 @@ class Costume:
         image.save(image_path)
 
     def decode_animations(self, encoded_costume, offset_table, anims_end):
-        ordered_anim_offsets = get_ordered_offsets(offset_table)
+        next_anim_offset_map = get_next_offset_map(get_ordered_offsets(offset_table), len(encoded_costume))
 
         self.anims = []
         self.anim_index_map = []
@@ -568,18 +587,10 @@ class Costume:
                 offset_to_anim_index_map[anim_offset] = len(self.anims)
                 self.anim_index_map.append(len(self.anims))
 
-                next_anim_offset = 0
+                next_anim_offset = anims_end
 
-                if i == self.settings.anim_count - 1:
-                    next_anim_offset = anims_end
-                else:
-                    for j in range(len(ordered_anim_offsets)):
-                        if ordered_anim_offsets[j] == anim_offset:
-                            if j == len(ordered_anim_offsets) - 1:
-                                next_anim_offset = len(encoded_costume)
-                            else:
-                                next_anim_offset = ordered_anim_offsets[j + 1]
-                            break
+                if i < self.settings.anim_count - 1:
+                    next_anim_offset = next_anim_offset_map[anim_offset]
 
 
                 encoded_animation = encoded_costume[anim_offset:next_anim_offset]
@@ -590,7 +601,8 @@ class Costume:
 
 
     def decode_limbs(self, encoded_costume, offset_table, base_offset):
-        ordered_limb_offsets = get_ordered_offsets(offset_table)
+        # the last limb ends where the picts begin, which is only known once the limbs before it are read
+        next_limb_offset_map = get_next_offset_map(get_ordered_offsets(offset_table), None)
 
         self.limbs = []
         self.limb_index_map = []
@@ -609,15 +621,10 @@ class Costume:
                 self.limb_index_map.append(offset_to_limb_index_map[limb_offset])
             
             else:
-                next_limb_offset = 0
-
-                for j in range(len(ordered_limb_offsets)):
-                    if ordered_limb_offsets[j] == limb_offset:
-                        if j == len(ordered_limb_offsets) - 1:
-                            next_limb_offset = first_pict_offset
-                        else:
-                            next_limb_offset = ordered_limb_offsets[j + 1]
-                        break
+                next_limb_offset = next_limb_offset_map[limb_offset]
+
+                if next_limb_offset is None:
+                    next_limb_offset = first_pict_offset
                 
                 encoded_limb = encoded_costume[limb_offset:next_limb_offset]
 
@@ -643,7 +650,7 @@ class Costume:
         for limb in self.limbs:
             all_pict_offsets += limb.offset_table
 
-        ordered_pict_offsets = get_ordered_offsets(all_pict_offsets)
+        next_pict_offset_map = get_next_offset_map(get_ordered_offsets(all_pict_offsets), len(encoded_costume))
 
         limb_count = len(self.limbs)
         offset_to_pict_index_map = {}
@@ -665,14 +672,7 @@ class Costume:
                     offset_to_pict_index_map[pict_offset] = len(self.picts)
                     limb.pict_index_map.append(len(self.picts))
 
-                    next_pict_offset = 0
-                    for k in range(len(ordered_pict_offsets)):
-                        if ordered_pict_offsets[k] == pict_offset:
-                            if k == len(ordered_pict_offsets) - 1:
-                                next_pict_offset = len(encoded_costume)
-                            else:
-                                next_pict_offset = ordered_pict_offsets[k + 1]
-                            break
+                    next_pict_offset = next_pict_offset_map[pict_offset]
 
                     pict = Pict()
                     pict.decode(encoded_costume[pict_offset:next_pict_offset], i, frame_number, self.settings.allow_redirectable_picts, self.palette)
@@ -692,18 +692,52 @@ class Costume:
 
     def encode_picts(self):
         encoded_picts = []
+        encoded_pict_map = []
+
+        encoded_pict_indices = {}
 
         for pict in self.picts:
-            encoded_pict = pict.encode(self.palette, self.settings.allow_redirectable_picts)
+            encoded_pict = None
+
+            if self.pict_cache is not None:
+                pict_key = self.pict_cache.get_key(pict, self.palette, self.settings.allow_redirectable_picts)
+                encoded_pict = self.pict_cache.get(pict_key)
+
+            if encoded_pict is None:
+                quantized_pixel_count = palette_codec.quantized_pixel_count
+                encoded_pict = pict.encode(self.palette, self.settings.allow_redirectable_picts)
+
+                # quantized picts are encoded every time, so exact mode still refuses them and their pixels are still counted
+                if self.pict_cache is not None and palette_codec.quantized_pixel_count == quantized_pixel_count:
+                    self.pict_cache.add(pict_key, encoded_pict)
+
+            if dedupe_picts:
+                # the encoded bytes start with the pict's header fields, so equal bytes mean an identical pict
+                encoded_pict = bytes(encoded_pict)
+
+                if encoded_pict in encoded_pict_indices:
+                    encoded_pict_map.append(encoded_pict_indices[encoded_pict])
+                    continue
+
+                encoded_pict_indices[encoded_pict] = len(encoded_picts)
+
+            encoded_pict_map.append(len(encoded_picts))
             encoded_picts.append(encoded_pict)
         
-        return encoded_picts
+        return (encoded_picts, encoded_pict_map)
 
-    def encode_limbs(self, encoded_picts, encoded_picts_start, base_offset):
+    def encode_limbs(self, encoded_picts, encoded_pict_map, encoded_picts_start, base_offset):
         encoded_limbs = []
 
         for limb in self.limbs:
-            encoded_limb = encode_offset_table(encoded_picts, encoded_picts_start - base_offset, limb.pict_index_map, False)
+            encoded_pict_index_map = []
+            for pict_index in limb.pict_index_map:
+                if pict_index == -1:
+                    encoded_pict_index_map.append(-1)
+                else:
+                    encoded_pict_index_map.append(encoded_pict_map[pict_index])
+
+            encoded_limb = encode_offset_table(encoded_picts, encoded_picts_start - base_offset, encoded_pict_index_map, False)
             encoded_limbs.append(encoded_limb)
         
         return encoded_limbs
@@ -718,17 +752,24 @@ class Costume:
         
         encoded_settings = self.settings.encode()
 
+        room_palette = palette_codec.get_palette(room_palette)
+
         palette_map = []
-        for color in self.palette:
+        for i in range(len(self.palette)):
+            color = self.palette[i]
+
             if len(room_palette) == 16:
-                palette_index = image_codec.get_palette_index(color, room_palette)
+                palette_index = room_palette.get_index(color)
                 palette_map.append(palette_index)
             else:
-                palette_index = get_palette_index_prioritising_global_colors(color, room_palette)
+                palette_index = room_palette.get_index_prioritising_global_colors(color)
                 palette_map.append(palette_index)
+            
+            if not room_palette.has_color(color):
+                print(f"Quantized color {i} of the costume palette to room palette color {palette_index}")
 
         encoded_anims = self.encode_anims()
-        encoded_picts = self.encode_picts()
+        (encoded_picts, encoded_pict_map) = self.encode_picts()
 
         encoded_anims_length = 0
         for encoded_anim in encoded_anims:
@@ -747,7 +788,7 @@ class Costume:
         encoded_limbs_start = commands_start + len(self.commands)
         encoded_picts_start = encoded_limbs_start + encoded_limbs_length
 
-        encoded_limbs = self.encode_limbs(encoded_picts, encoded_picts_start, base_offset)        
+        encoded_limbs = self.encode_limbs(encoded_picts, encoded_pict_map, encoded_picts_start, base_offset)        
 
         encoded_limb_offset_table = encode_offset_table(encoded_limbs, encoded_limbs_start - base_offset, self.limb_index_map, True)
         encoded_anim_offset_table = encode_offset_table(encoded_anims, encoded_anims_start - base_offset, self.anim_index_map, False)
@@ -830,19 +871,32 @@ class Costume:
             pict.deserialise(serialised_pict, spritesheet)
             self.picts.append(pict)
         
+        self.palette = palette_codec.Palette()
+
+        spritesheet_palette = []
+        if spritesheet.mode == "P":
+            spritesheet_palette = spritesheet.getpalette()
+
         for i in range(self.settings.palette_size):
             color = spritesheet.getpixel((i, 0))
+
+            if spritesheet.mode == "P":
+                color = tuple(spritesheet_palette[color * 3:color * 3 + 3])
+
             self.palette.append(color)
 
 
-def build_spritesheet(picts, palette):
-    palette_size = len(palette)
-    background_color = palette[0]
+paletted_png = False
+packed_spritesheets = False
+dedupe_picts = False
+reuse_cached_picts = True
 
-    spritesheet_width = palette_size
-    spritesheet_height = 9
+spritesheet_header_height = 9
+max_spritesheet_width = 640
 
-    max_spritesheet_width = 640
+def lay_out_picts_in_rows(picts, palette_size):
+    spritesheet_width = palette_size
+    spritesheet_height = spritesheet_header_height
 
     i = 0
     current_limb_number = 0
@@ -877,18 +931,131 @@ def build_spritesheet(picts, palette):
 
         if row_width > spritesheet_width:
             spritesheet_width = row_width
+    
+    return (spritesheet_width, spritesheet_height)
+
+def find_skyline_position(skyline, skyline_width, rect_width):
+    best_position = None
+
+    for i in range(len(skyline)):
+        x = skyline[i][0]
+
+        if x + rect_width > skyline_width:
+            break
+
+        # the rect rests on the highest segment underneath it
+        y = 0
+        j = i
+        while j < len(skyline) and skyline[j][0] < x + rect_width:
+            y = max(y, skyline[j][1])
+            j += 1
+
+        if best_position is None or y < best_position[1]:
+            best_position = (x, y)
+    
+    return best_position
+
+def raise_skyline(skyline, x, top, rect_width):
+    rect_right = x + rect_width
+    raised_skyline = []
+
+    for (segment_x, segment_y, segment_width) in skyline:
+        segment_right = segment_x + segment_width
+
+        if segment_right <= x or segment_x >= rect_right:
+            raised_skyline.append((segment_x, segment_y, segment_width))
+            continue
+
+        if segment_x < x:
+            raised_skyline.append((segment_x, segment_y, x - segment_x))
+
+        if segment_x <= x:
+            raised_skyline.append((x, top, rect_width))
+
+        if segment_right > rect_right:
+            raised_skyline.append((rect_right, segment_y, segment_right - rect_right))
+
+    merged_skyline = [raised_skyline[0]]
+    for segment in raised_skyline[1:]:
+        previous_segment = merged_skyline[-1]
+
+        if previous_segment[1] == segment[1]:
+            merged_skyline[-1] = (previous_segment[0], previous_segment[1], previous_segment[2] + segment[2])
+        else:
+            merged_skyline.append(segment)
+    
+    return merged_skyline
+
+def pack_picts_on_skyline(picts, pict_order, skyline_width):
+    skyline = [(0, spritesheet_header_height, skyline_width)]
+    positions = [None] * len(picts)
 
+    spritesheet_width = 0
+    spritesheet_height = spritesheet_header_height
+
+    for i in pict_order:
+        # every pict keeps a one pixel gap to its right and below, like in the row layout
+        rect_width = picts[i].width + 1
+        rect_height = picts[i].height + 1
+
+        (x, y) = find_skyline_position(skyline, skyline_width, rect_width)
+        skyline = raise_skyline(skyline, x, y + rect_height, rect_width)
+
+        positions[i] = (x, y)
+        spritesheet_width = max(spritesheet_width, x + rect_width)
+        spritesheet_height = max(spritesheet_height, y + rect_height)
+    
+    return (positions, spritesheet_width, spritesheet_height)
+
+def lay_out_picts_packed(picts, palette_size):
+    # tallest picts go first, so each level of the skyline gets filled by picts of a similar height
+    pict_order = sorted(range(len(picts)), key = lambda i: (-picts[i].height, -picts[i].width))
+
+    narrowest_width = palette_size
+    total_area = 0
+    for pict in picts:
+        narrowest_width = max(narrowest_width, pict.width + 1)
+        total_area += (pict.width + 1) * (pict.height + 1)
+
+    best_layout = None
+
+    for width_factor in [1.0, 1.25, 1.5, 2.0]:
+        skyline_width = max(narrowest_width, int(math.sqrt(total_area) * width_factor))
+        layout = pack_picts_on_skyline(picts, pict_order, skyline_width)
+
+        spritesheet_width = max(palette_size, layout[1])
+        if best_layout is None or spritesheet_width * layout[2] < best_layout[1] * best_layout[2]:
+            best_layout = (layout[0], spritesheet_width, layout[2])
+
+    (positions, spritesheet_width, spritesheet_height) = best_layout
+
+    for i in range(len(picts)):
+        (picts[i].spritesheet_x, picts[i].spritesheet_y) = positions[i]
+    
+    return (spritesheet_width, spritesheet_height)
+
+def build_spritesheet(picts, palette):
+    palette_size = len(palette)
+
+    if packed_spritesheets:
+        (spritesheet_width, spritesheet_height) = lay_out_picts_packed(picts, palette_size)
+    else:
+        (spritesheet_width, spritesheet_height) = lay_out_picts_in_rows(picts, palette_size)
         
-    spritesheet = Image.new(mode = "RGB", size = (spritesheet_width, spritesheet_height))
-    spritesheet.paste(palette[0], (0, 0, spritesheet_width, spritesheet_height))
+    spritesheet = Image.new(mode = "P", size = (spritesheet_width, spritesheet_height))
 
     for i in range(palette_size):
-        spritesheet.putpixel((i, 0), palette[i])
+        spritesheet.putpixel((i, 0), i)
 
     for pict in picts:
         spritesheet.paste(pict.image, (pict.spritesheet_x, pict.spritesheet_y))
 
-    return spritesheet
+    spritesheet.putpalette(image_codec.flatten_palette(palette))
+
+    if paletted_png:
+        return spritesheet
+
+    return spritesheet.convert("RGB")
 
 def get_room_palette(encoded_costume_path, version):
     room_palette_path = ""
@@ -900,11 +1067,70 @@ def get_room_palette(encoded_costume_path, version):
     room_palette = palette_codec.decode(room_palette_path, version, [], False)
     return room_palette
 
+def get_palette_map_colors(palette_map, room_palette):
+    colors = []
+    for index in palette_map:
+        colors.append(tuple(room_palette[index][0:3]))
+    
+    return colors
+
+def remap(encoded_costume_path, version, video_type, color_table):
+    encoded_file = open(encoded_costume_path, 'rb')
+    encoded_costume = bytearray(encoded_file.read())
+    encoded_file.close()
+
+    header_length = 6
+    if version == '5':
+        header_length = 8
+
+    palette_size = 16 + 16 * (encoded_costume[header_length + 1] & 1)
+    p = header_length + 2
+
+    # picts index the costume's own palette, so only its map into the room palette needs to change
+    palette_map = encoded_costume[p:p + palette_size]
+    remapped_palette_map = palette_map.translate(color_table)
+
+    remapped_color_count = 0
+    for i in range(palette_size):
+        if remapped_palette_map[i] != palette_map[i]:
+            remapped_color_count += 1
+
+    if remapped_color_count == 0:
+        return 0
+    
+    print(f"Remapped {remapped_color_count} palette colors of {encoded_costume_path}")
+
+    room_palette = image_codec.ega_palette
+    if video_type == 'vga':
+        room_palette = get_room_palette(encoded_costume_path, version)
+
+    # the spritesheet stores the colors themselves, so entries that now share one can't be told apart when it's encoded again
+    if len(set(get_palette_map_colors(remapped_palette_map, room_palette))) < len(set(get_palette_map_colors(palette_map, room_palette))):
+        print(f"Warning: Remapping merged colors of the costume palette of {encoded_costume_path}")
+
+    encoded_costume[p:p + palette_size] = remapped_palette_map
+
+    encoded_file = open(encoded_costume_path, 'wb')
+    encoded_file.write(encoded_costume)
+    encoded_file.close()
+
+    return remapped_color_count
+
+decoded_costumes = {}
+
+def get_decoded_costume_key(encoded_costume, version, video_type, room_palette):
+    costume_hash = hashlib.blake2b(digest_size=16)
+    costume_hash.update(f"{version}:{video_type}:".encode())
+    costume_hash.update(bytes(image_codec.flatten_palette(room_palette)))
+    costume_hash.update(encoded_costume)
+
+    return costume_hash.hexdigest()
+
 def decode(encoded_costume_path, version, timestamp_manager, video_type, room_palette=[]):
     print(f"Decoding {encoded_costume_path}")
 
     encoded_file = open(encoded_costume_path, 'rb')
-    encoded_costume = encoded_file.read()
+    encoded_costume = memoryview(encoded_file.read())
     encoded_file.close()
 
     if video_type == 'ega':
@@ -912,23 +1138,77 @@ def decode(encoded_costume_path, version, timestamp_manager, video_type, room_pa
     elif video_type == 'vga' and room_palette == []:
         room_palette = get_room_palette(encoded_costume_path, version)
 
+    json_file_path = Path(encoded_costume_path.parent, "_" + encoded_costume_path.name.replace(".dmp", "_animdata.json"))
+    spritesheet_file_path = Path(encoded_costume_path.parent, "_" + encoded_costume_path.name.replace(".dmp", "_spritesheet.png"))
+
+    # costumes shared between rooms or repeated across disks decode to the same files, so those are copied instead
+    costume_key = get_decoded_costume_key(encoded_costume, version, video_type, room_palette)
+
+    if costume_key in decoded_costumes:
+        (decoded_json_file_path, decoded_spritesheet_file_path) = decoded_costumes[costume_key]
+
+        if decoded_json_file_path != json_file_path:
+            file_writer.save_copy(decoded_json_file_path, json_file_path, timestamp_manager)
+            file_writer.save_copy(decoded_spritesheet_file_path, spritesheet_file_path, timestamp_manager)
+            return
+
     costume = Costume()
     costume.decode(encoded_costume, version, room_palette)
 
     spritesheet = build_spritesheet(costume.picts, costume.palette)
     serialised_data = costume.serialise()
 
-    json_file_path = Path(encoded_costume_path.parent, "_" + encoded_costume_path.name.replace(".dmp", "_animdata.json"))
-    json_file = open(json_file_path, 'w')
-    json_file.write(json.dumps(serialised_data, indent = 4))
-    json_file.close()
+    file_writer.save_text(json.dumps(serialised_data, indent = 4), json_file_path, timestamp_manager)
+    file_writer.save_image(spritesheet, spritesheet_file_path, timestamp_manager)
 
-    spritesheet_file_path = Path(encoded_costume_path.parent, "_" + encoded_costume_path.name.replace(".dmp", "_spritesheet.png"))
-    spritesheet.save(spritesheet_file_path)
+    decoded_costumes[costume_key] = (json_file_path, spritesheet_file_path)
 
-    if timestamp_manager != []:
-        timestamp_manager.add_timestamp(json_file_path)
-        timestamp_manager.add_timestamp(spritesheet_file_path)
+def verify(encoded_costume_path, version, video_type, room_palette=[]):
+    # goes through the spritesheet and serialised data like a decompile and build would, without touching the disk
+    encoded_file = open(encoded_costume_path, 'rb')
+    encoded_costume = memoryview(encoded_file.read())
+    encoded_file.close()
+
+    if video_type == 'ega':
+        room_palette = image_codec.ega_palette
+    elif video_type == 'vga' and room_palette == []:
+        room_palette = get_room_palette(encoded_costume_path, version)
+
+    costume = Costume()
+    costume.decode(encoded_costume, version, room_palette)
+
+    spritesheet = build_spritesheet(costume.picts, costume.palette)
+    serialised_data = json.loads(json.dumps(costume.serialise()))
+
+    rebuilt_costume = Costume()
+    rebuilt_costume.deserialise(serialised_data, spritesheet)
+    reencoded_costume = rebuilt_costume.encode(version, room_palette)
+
+    reencoded = Costume()
+    reencoded.decode(memoryview(bytes(reencoded_costume)), version, room_palette)
+    build_spritesheet(reencoded.picts, reencoded.palette)
+
+    mismatches = []
+
+    if len(reencoded.picts) != len(costume.picts):
+        return [f"{len(costume.picts)} picts became {len(reencoded.picts)}"]
+
+    for i in range(len(costume.picts)):
+        pict = costume.picts[i]
+
+        if reencoded.picts[i].image.tobytes() != pict.image.tobytes() or reencoded.picts[i].serialise() != pict.serialise():
+            mismatches.append(f"pict {i} (limb {pict.limb_number}, frame {pict.frame_number})")
+
+    if reencoded.palette != costume.palette:
+        mismatches.append("palette")
+
+    reencoded_data = reencoded.serialise()
+
+    for field in serialised_data:
+        if field != "Picts" and reencoded_data[field] != serialised_data[field]:
+            mismatches.append(field.lower())
+
+    return mismatches
 
 
 def find_matching_files(file_path):
@@ -942,6 +1222,44 @@ def find_matching_files(file_path):
 
 
 
+def get_pict_data_start(encoded_costume, version):
+    base_offset = 0
+    header_length = 6
+    if version == '5':
+        base_offset = 2
+        header_length = 8
+
+    palette_size = 16 + 16 * (encoded_costume[header_length + 1] & 1)
+    p = header_length + 2 + palette_size + 2
+
+    limb_offset_table = decode_offset_table(encoded_costume[p:p+32], 16, base_offset)
+
+    # limb tables sit back to back right before the picts, so they're read until the first pict is reached
+    p = find_lowest_offset(limb_offset_table)
+    if p == -1:
+        return len(encoded_costume)
+
+    first_pict_offset = len(encoded_costume)
+    while p + 2 <= first_pict_offset:
+        pict_offset = le_decode(encoded_costume[p:p+2], 2) + base_offset
+        p += 2
+
+        if pict_offset > 2 and pict_offset < first_pict_offset:
+            first_pict_offset = pict_offset
+
+    return first_pict_offset
+
+def get_size_report_details(original_costume, encoded_costume, version, pict_count):
+    original_pict_data_size = None
+    if original_costume is not None:
+        original_pict_data_size = len(original_costume) - get_pict_data_start(original_costume, version)
+
+    return {
+        "pict_count": pict_count,
+        "original_pict_data_size": original_pict_data_size,
+        "pict_data_size": len(encoded_costume) - get_pict_data_start(encoded_costume, version)
+    }
+
 def encode(decoded_costume_path, version, timestamp_manager, video_type, room_palette=[]):
     print(f"Encoding {decoded_costume_path}")
 
@@ -962,13 +1280,37 @@ def encode(decoded_costume_path, version, timestamp_manager, video_type, room_pa
 
     costume.deserialise(serialised_costume, spritesheet)
 
+    pict_cache_path = Path(json_file_path.parent, json_file_path.name.replace("_animdata.json", "_picts.cache"))
+
+    if reuse_cached_picts:
+        costume.pict_cache = PictCache()
+        costume.pict_cache.load(pict_cache_path)
+
     encoded_costume = costume.encode(version, room_palette)
 
+    if reuse_cached_picts:
+        costume.pict_cache.save(pict_cache_path)
+
     encoded_costume_path = Path(json_file_path.parent, json_file_path.name[1:].replace("_animdata.json", ".dmp"))
+
+    original_costume = None
+    if size_report.enabled and encoded_costume_path.is_file():
+        original_costume_file = open(encoded_costume_path, 'rb')
+        original_costume = original_costume_file.read()
+        original_costume_file.close()
+
     encoded_costume_file = open(encoded_costume_path, 'wb')
     encoded_costume_file.write(bytes(encoded_costume))
     encoded_costume_file.close()
 
+    if size_report.enabled:
+        original_size = None
+        if original_costume is not None:
+            original_size = len(original_costume)
+
+        report_details = get_size_report_details(original_costume, bytes(encoded_costume), version, len(costume.picts))
+        size_report.add_asset(encoded_costume_path, "costume", original_size, len(encoded_costume), report_details)
+
     if timestamp_manager != []:
         timestamp_manager.add_timestamp(json_file_path)
         timestamp_manager.add_timestamp(spritesheet_file_path)
@@ -0,0 +1,117 @@
+import os, threading, shutil
+from concurrent.futures import ThreadPoolExecutor
+
+png_compression_level = 6
+
+def sync_file(open_file):
+    # flushed all the way to the disk, so a timestamp is never recorded for a file a crash could still lose
+    open_file.flush()
+    os.fsync(open_file.fileno())
+
+def write_image(image, file_path):
+    image_file = open(file_path, 'wb')
+    image.save(image_file, format="PNG", compress_level=png_compression_level)
+    sync_file(image_file)
+    image_file.close()
+
+def write_text(text, file_path):
+    text_file = open(file_path, 'w')
+    text_file.write(text)
+    sync_file(text_file)
+    text_file.close()
+
+def copy_file(source_path, file_path):
+    source_file = open(source_path, 'rb')
+    copied_file = open(file_path, 'wb')
+    shutil.copyfileobj(source_file, copied_file)
+    sync_file(copied_file)
+    copied_file.close()
+    source_file.close()
+
+class FileWriter:
+    executor = None
+
+    pending_writes = []
+    pending_files = {}
+    write_slots = None
+
+    def __init__(self):
+        self.executor = None
+        self.pending_writes = []
+        self.pending_files = {}
+        self.write_slots = None
+
+    def start(self, thread_count, max_pending_writes):
+        self.finish()
+
+        if thread_count > 0:
+            self.executor = ThreadPoolExecutor(thread_count)
+            self.write_slots = threading.BoundedSemaphore(max_pending_writes)
+
+    def save_image(self, image, file_path, timestamp_manager):
+        self.submit(write_image, (image, file_path), file_path, timestamp_manager)
+
+    def save_text(self, text, file_path, timestamp_manager):
+        self.submit(write_text, (text, file_path), file_path, timestamp_manager)
+
+    def save_copy(self, source_path, file_path, timestamp_manager):
+        # the source may still be waiting to be written, so it has to land on disk before it's copied
+        if source_path in self.pending_files:
+            self.pending_files[source_path].result()
+
+        self.submit(copy_file, (source_path, file_path), file_path, timestamp_manager)
+
+    def submit(self, write_function, arguments, file_path, timestamp_manager):
+        if self.executor is None:
+            self.write_and_add_timestamp(write_function, arguments, file_path, timestamp_manager)
+            return
+
+        # waits for a free slot, so decoding can't get too far ahead of the disk
+        self.write_slots.acquire()
+
+        still_pending = []
+        for future in self.pending_writes:
+            if future.done():
+                future.result()
+            else:
+                still_pending.append(future)
+
+        self.pending_writes = still_pending
+
+        still_pending_files = {}
+        for pending_file_path in self.pending_files:
+            if not self.pending_files[pending_file_path].done():
+                still_pending_files[pending_file_path] = self.pending_files[pending_file_path]
+        
+        self.pending_files = still_pending_files
+
+        future = self.executor.submit(self.write_in_background, write_function, arguments, file_path, timestamp_manager)
+        self.pending_writes.append(future)
+        self.pending_files[file_path] = future
+
+    def write_in_background(self, write_function, arguments, file_path, timestamp_manager):
+        try:
+            self.write_and_add_timestamp(write_function, arguments, file_path, timestamp_manager)
+        finally:
+            self.write_slots.release()
+
+    def write_and_add_timestamp(self, write_function, arguments, file_path, timestamp_manager):
+        write_function(*arguments)
+
+        # the file is synced and closed by now, so its timestamp won't change again
+        if timestamp_manager != []:
+            timestamp_manager.add_timestamp(file_path)
+
+    def finish(self):
+        pending_writes = self.pending_writes
+        self.pending_writes = []
+        self.pending_files = {}
+
+        for future in pending_writes:
+            future.result()
+
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+file_writer = FileWriter()
@@ -1,92 +1,76 @@
-import sys, os, json, math, re, timestamp_manager, palette_codec
+import sys, os, json, math, re, time, hashlib, bisect, timestamp_manager, palette_codec
 from binary_functions import *
+from file_writer import file_writer
+from size_report import size_report
 from PIL import Image
 from pathlib import Path
+from collections import OrderedDict
 import xml.etree.ElementTree as xml_garbage
 
 HORIZONTAL = 0
 VERTICAL = 1
 
 class Stripe:
-    x = 0
-    y = 0
+    # a stripe is a view over a column-major buffer, usually holding the whole image, starting at its left column
+    __slots__ = ('height', 'pixels', 'start')
 
-    previous_read_x = -1
-    previous_read_y = -1
+    def __init__(self, height, pixels=None, start=0):
+        self.height = height
+        self.start = start
 
-    height = 144
-    direction = HORIZONTAL
+        if pixels is None:
+            pixels = bytearray(8 * height)
+        self.pixels = pixels
 
-    pixels = []
+    def fill(self, position, count, color):
+        start = self.start + position
+        self.pixels[start:start + count] = bytes((color,)) * count
 
-    def __init__(self, height, direction):
-        self.height = height
-        self.direction = direction
+    def fill_pattern(self, position, count, pattern):
+        start = self.start + position
+        self.pixels[start:start + count] = (pattern * (count // len(pattern) + 1))[:count]
 
-        self.pixels = [0] * (height * 8)
-    
-    def reset(self, direction):
-        self.x = 0
-        self.y = 0
-        self.direction = direction
-    
-    def write_color(self, color):
-        if not self.within_bounds():
-            return
+    def copy_previous_column(self, position, count):
+        start = self.start + position
 
-        self.pixels[self.y * 8 + self.x] = color
-
-        if self.direction == HORIZONTAL:
-            self.x += 1
-            if self.x >= 8:
-                self.x = 0
-                self.y += 1
-        elif self.direction == VERTICAL:
-            self.y += 1
-            if self.y >= self.height:
-                self.y = 0
-                self.x += 1
-    
-    def read_color(self):
-        if not self.within_bounds():
-            return 0
+        # copy at most one column at a time, since a long copy reads pixels it has just written
+        while count > 0:
+            source = start - self.height
+            chunk_length = min(count, self.height)
 
-        pixel = self.pixels[self.y * 8 + self.x]
-
-        self.previous_read_x = self.x
-        self.previous_read_y = self.y
-
-        if self.direction == HORIZONTAL:
-            self.x += 1
-            if self.x >= 8:
-                self.x = 0
-                self.y += 1
-        elif self.direction == VERTICAL:
-            self.y += 1
-            if self.y >= self.height:
-                self.y = 0
-                self.x += 1
-                
-        return pixel
-    
-    def get_coordinates_of_most_recent_read(self):
-        return (self.previous_read_x, self.previous_read_y)
+            if source < 0:
+                # nothing left of the image, so the engine reads zeros
+                chunk_length = min(count, -source)
+                self.pixels[start:start + chunk_length] = bytes(chunk_length)
+            else:
+                self.pixels[start:start + chunk_length] = self.pixels[source:source + chunk_length]
+            
+            start += chunk_length
+            count -= chunk_length
 
-    def read_color_at_coordinate(self, temp_x, temp_y):
-        self.previous_read_x = temp_x
-        self.previous_read_y = temp_y
+    def write_columns(self, colors):
+        self.pixels[self.start:self.start + len(colors)] = colors
 
-        return self.pixels[temp_y * 8 + temp_x]
+    def write_rows(self, colors):
+        for x in range(8):
+            column = colors[x::8]
+            column_start = self.start + x * self.height
+            self.pixels[column_start:column_start + len(column)] = column
 
-    def write_colors_from_byte(self, byte):
-        i = 7
-        while i >= 0:
-            bit = (byte >> i) & 1
-            self.write_color(bit)
-            i -= 1
+    def read_column(self, x):
+        column_start = self.start + x * self.height
+        return self.pixels[column_start:column_start + self.height]
 
-    def within_bounds(self):
-        return (self.x < 8) and (self.y < self.height)
+    def read_columns(self):
+        return bytes(self.pixels[self.start:self.start + 8 * self.height])
+
+    def read_rows(self):
+        rows = bytearray(8 * self.height)
+
+        for x in range(8):
+            rows[x::8] = self.read_column(x)
+        
+        return bytes(rows)
 
 class Bitstream:
     data = []
@@ -150,16 +134,29 @@ class Bitstream:
             bit = (value >> i) & 1
             self.write_bit(bit)
 
+    def write_zero_bits(self, count):
+        bit_index = self.bit_index + count
+        finished_bytes = bit_index >> 3
+
+        if finished_bytes > 0:
+            self.data += [0] * finished_bytes
+            self.byte_index += finished_bytes
+            self.byte = 0
+        
+        self.bit_index = bit_index & 7
+
 
 COPY_PREVIOUS_COLUMN = 2
 DITHER = 3
 
-def decode_stripe_ega(stripe_data, height):
-    stripe = Stripe(height, VERTICAL)
+def decode_stripe_ega(stripe_data, stripe):
+    # ega stripes are drawn top to bottom, column by column
+    pixel_count = 8 * stripe.height
+    position = 0
 
     p = 0
 
-    while p < len(stripe_data):
+    while p < len(stripe_data) and position < pixel_count:
         byte = stripe_data[p]
         p += 1
 
@@ -171,10 +168,11 @@ def decode_stripe_ega(stripe_data, height):
             if repeat == 0:
                 repeat = stripe_data[p]
                 p += 1
+            
+            repeat = min(repeat, pixel_count - position)
 
-            for i in range(repeat):
-                previous_column = 8 * stripe.y + stripe.x - 1
-                stripe.write_color(stripe.pixels[previous_column])
+            stripe.copy_previous_column(position, repeat)
+            position += repeat
 
         elif command == DITHER:
             repeat = byte & 0x3F
@@ -185,18 +183,14 @@ def decode_stripe_ega(stripe_data, height):
             if repeat == 0:
                 repeat = stripe_data[p]
                 p += 1
+            
+            repeat = min(repeat, pixel_count - position)
 
             color_a = colors & 0x0F
             color_b = (colors & 0xF0) >> 4
 
-            dither_pattern = False
-
-            for i in range(repeat):
-                if dither_pattern:
-                    stripe.write_color(color_a)
-                else:
-                    stripe.write_color(color_b)
-                dither_pattern = not dither_pattern
+            stripe.fill_pattern(position, repeat, bytes((color_b, color_a)))
+            position += repeat
 
         else:
             repeat = (byte & 0xF0) >> 4
@@ -206,10 +200,46 @@ def decode_stripe_ega(stripe_data, height):
                 repeat = stripe_data[p]
                 p += 1
             
-            for i in range(repeat):
-                stripe.write_color(color)
+            repeat = min(repeat, pixel_count - position)
+
+            stripe.fill(position, repeat, color)
+            position += repeat
+    
+    return position
+
+def reads_previous_stripe(stripe_data, height):
+    # a copy within the first column reads the last column of the stripe to the left
+    position = 0
+
+    p = 0
+
+    while p < len(stripe_data) and position < height:
+        byte = stripe_data[p]
+        p += 1
+
+        command = (byte & 0xC0) >> 6
+
+        if command == COPY_PREVIOUS_COLUMN:
+            return True
+        
+        elif command == DITHER:
+            repeat = byte & 0x3F
+            p += 1
+
+            if repeat == 0:
+                repeat = stripe_data[p]
+                p += 1
+
+        else:
+            repeat = (byte & 0xF0) >> 4
+
+            if repeat == 0:
+                repeat = stripe_data[p]
+                p += 1
+        
+        position += repeat
     
-    return stripe
+    return False
 
 S_WRITE_COLOR = 0
 S_READ_COMMAND = 1
@@ -217,22 +247,31 @@ S_SET_COLOR = 2
 S_SHIFT_COLOR = 3
 S_REPEAT_COLOR = 4
 
-def decode_stripe_vga(stripe_data, height):
+def write_stripe_colors(colors, direction, stripe):
+    if direction == VERTICAL:
+        stripe.write_columns(colors)
+    else:
+        stripe.write_rows(colors)
+
+def decode_stripe_vga(stripe_data, stripe):
     key = stripe_data[0]
 
     palette_index_size = key % 10
     direction = math.floor(key / 10) % 2
     alt_algorithm = key >= 50
 
-    stripe = Stripe(height, direction)
+    pixel_count = 8 * stripe.height
 
     if key == 1:
         # rare uncompressed case which shows up occasionally
-        stripe.pixels = stripe_data[1:]
-        return stripe
+        colors = stripe_data[1:1 + pixel_count]
+        write_stripe_colors(colors, HORIZONTAL, stripe)
+        return len(colors)
+
+    colors = bytearray()
 
     color = stripe_data[1]
-    stripe.write_color(color)
+    colors.append(color)
     color_shift = -1
 
 
@@ -240,12 +279,12 @@ def decode_stripe_vga(stripe_data, height):
 
     bitstream = Bitstream(stripe_data[2:])
 
-    while bitstream.within_bounds():
+    while bitstream.within_bounds() and len(colors) < pixel_count:
         if state == S_WRITE_COLOR:
             bit = bitstream.read_bit()
 
             if bit == 0:
-                stripe.write_color(color)
+                colors.append(color)
             elif bit == 1:
                 state = S_READ_COMMAND
         
@@ -260,7 +299,7 @@ def decode_stripe_vga(stripe_data, height):
         elif state == S_SET_COLOR:
             color_shift = -1
             color = bitstream.read_integer(palette_index_size)
-            stripe.write_color(color)
+            colors.append(color)
 
             state = S_WRITE_COLOR
         
@@ -270,8 +309,8 @@ def decode_stripe_vga(stripe_data, height):
             if bit == 1:
                 color_shift *= -1
 
-            color += color_shift
-            stripe.write_color(color)
+            color = (color + color_shift) & 0xff
+            colors.append(color)
 
             state = S_WRITE_COLOR
         
@@ -282,28 +321,41 @@ def decode_stripe_vga(stripe_data, height):
                 state = S_REPEAT_COLOR
             else:
                 color_shift = command
-                color += color_shift
-                stripe.write_color(color)
+                color = (color + color_shift) & 0xff
+                colors.append(color)
 
                 state = S_WRITE_COLOR
         
         elif state == S_REPEAT_COLOR and alt_algorithm:
             repeat_count = bitstream.read_integer(8)
 
-            for i in range(repeat_count):
-                stripe.write_color(color)
+            colors += bytes((color,)) * repeat_count
             
             state = S_WRITE_COLOR
 
-    return stripe
+    colors = colors[:pixel_count]
+    write_stripe_colors(colors, direction, stripe)
 
+    return len(colors)
+
+
+class ZplaneStripe:
+    # zplane stripes are kept as packed row masks, one byte per row with the leftmost pixel in the top bit
+    __slots__ = ('height', 'pixels')
+
+    def __init__(self, height, pixels):
+        self.height = height
+        self.pixels = pixels
+    
+    def within_bounds(self):
+        return len(self.pixels) < self.height
 
 def decode_stripe_zplane(stripe_data, height):
-    stripe = Stripe(height, HORIZONTAL)
+    rows = bytearray()
 
     p = 0
 
-    while p < len(stripe_data):
+    while p < len(stripe_data) and len(rows) < height:
         count = stripe_data[p]
         p += 1
 
@@ -315,41 +367,131 @@ def decode_stripe_zplane(stripe_data, height):
                 byte = stripe_data[p]
                 p += 1
 
-            while count > 0:
-                stripe.write_colors_from_byte(byte)
-                count -= 1
+            rows += bytes((byte,)) * count
         else:
-            while count > 0:
-                byte = stripe_data[p]
-                p += 1
-
-                stripe.write_colors_from_byte(byte)
-                count -= 1
+            rows += stripe_data[p:p+count]
+            p += count
     
-    while stripe.within_bounds():
-        stripe.write_color(0)
+    return ZplaneStripe(height, bytes(rows[:height]))
+
+def get_stripe_end_offsets(offset_table):
+    # stripes can share data or be stored out of order, so each one ends at the next higher offset
+    ordered_offsets = sorted(set(offset_table))
+    end_offsets = []
+
+    for offset in offset_table[:-1]:
+        i = bisect.bisect_right(ordered_offsets, offset)
+
+        if i < len(ordered_offsets):
+            end_offsets.append(ordered_offsets[i])
+        else:
+            end_offsets.append(offset)
     
-    return stripe
+    return end_offsets
 
 def decode_stripes(encoded_data, video_type, offset_table, width, height):
+    # every stripe is decoded into one buffer holding the whole image column by column
     stripe_count = int(width / 8)
-    stripes = []
+    stripe_size = 8 * height
+
+    pixels = bytearray(stripe_count * stripe_size)
+    decoded_lengths = []
+
+    end_offsets = get_stripe_end_offsets(offset_table)
 
     for i in range(stripe_count):
-        encoded_stripe = encoded_data[offset_table[i]:offset_table[i+1]]
-        
-        stripe = []
+        encoded_stripe = encoded_data[offset_table[i]:end_offsets[i]]
+
+        stripe = Stripe(height, pixels, i * stripe_size)
+
+        decoded_length = 0
         if video_type == 'ega':
-            stripe = decode_stripe_ega(encoded_stripe, height)
+            decoded_length = decode_stripe_ega(encoded_stripe, stripe)
         elif video_type == 'vga':
-            stripe = decode_stripe_vga(encoded_stripe, height)
-        elif video_type == 'zplane':
-            stripe = decode_stripe_zplane(encoded_stripe, height)
+            decoded_length = decode_stripe_vga(encoded_stripe, stripe)
+        
+        decoded_lengths.append(decoded_length)
+    
+    return (pixels, decoded_lengths)
 
-        stripes.append(stripe)
+def decode_zplane_stripes(encoded_data, offset_table, width, height):
+    stripe_count = int(width / 8)
+    stripes = []
+
+    end_offsets = get_stripe_end_offsets(offset_table)
+
+    for i in range(stripe_count):
+        encoded_stripe = encoded_data[offset_table[i]:end_offsets[i]]
+        stripes.append(decode_stripe_zplane(encoded_stripe, height))
     
     return stripes
 
+def is_blank_stripe_zplane(stripe_data, height):
+    row_count = 0
+
+    p = 0
+
+    while p < len(stripe_data) and row_count < height:
+        count = stripe_data[p]
+        p += 1
+
+        if count & 0x80:
+            if p < len(stripe_data) and stripe_data[p] != 0:
+                return False
+            
+            p += 1
+            row_count += count & 0x7f
+        else:
+            if any(stripe_data[p:p+count]):
+                return False
+            
+            p += count
+            row_count += count
+    
+    return True
+
+def is_blank_stripe_vga(stripe_data, height):
+    pixel_count = 8 * height
+
+    if stripe_data[0] == 1:
+        return not any(stripe_data[1:1 + pixel_count])
+    
+    if len(stripe_data) < 2 or stripe_data[1] != 0:
+        return False
+    
+    # a zero bit repeats the current color whatever the variant, so color 0 followed by nothing but zero bits is blank
+    return not any(stripe_data[2:2 + math.ceil((pixel_count - 1) / 8)])
+
+def is_blank_subimage(encoded_data, video_type, width, height, base_offset):
+    # checks the encoded stripes directly, so blank images can be skipped without decoding them.
+    # an image this can't vouch for is decoded as normal and may still turn out blank
+    if not video_type in ['vga', 'zplane']:
+        return False
+
+    word_size = word_size_table[video_type]
+    offset_table = decode_offset_table(encoded_data, width, word_size, base_offset)
+    end_offsets = get_stripe_end_offsets(offset_table)
+
+    checked_offsets = set()
+
+    for i in range(int(width / 8)):
+        if offset_table[i] in checked_offsets:
+            continue
+        
+        checked_offsets.add(offset_table[i])
+
+        encoded_stripe = encoded_data[offset_table[i]:end_offsets[i]]
+
+        if len(encoded_stripe) == 0:
+            return False
+        
+        if video_type == 'zplane' and not is_blank_stripe_zplane(encoded_stripe, height):
+            return False
+        elif video_type == 'vga' and not is_blank_stripe_vga(encoded_stripe, height):
+            return False
+    
+    return True
+
 word_size_table = {
     'ega': 2,
     'vga': 4,
@@ -371,28 +513,51 @@ def decode_offset_table(encoded_data, width, word_size, base_offset):
 
     return offset_table
 
-def composite_image_from_stripes(stripes, palette, width, height):
-    width = len(stripes) * 8
+def composite_zplane_from_stripes(stripes, width, height):
+    row_length = len(stripes)
+
+    packed_rows = bytearray(row_length * height)
 
-    image = Image.new(mode = "RGB", size = (width, height))
-    is_blank = True
+    for i in range(row_length):
+        rows = stripes[i].pixels
+        packed_rows[i:i + row_length * len(rows):row_length] = rows
+    
+    image = Image.frombytes("1", (row_length * 8, height), bytes(packed_rows))
+    is_blank = packed_rows.count(0) == len(packed_rows)
 
-    stripe_count = len(stripes)
+    if paletted_png:
+        mask = image.convert("L").point(lambda value: value >> 7)
 
-    for i in range(stripe_count):
-        for y in range(height):
-            for x in range(8):
-                palette_index = stripes[i].pixels[y * 8 + x]
+        image = Image.frombytes("P", mask.size, mask.tobytes())
+        image.putpalette(flatten_palette(zplane_palette))
 
-                image.putpixel((i * 8 + x, y), palette[palette_index])
+        return (image, is_blank)
 
-                if palette_index != 0:
-                    is_blank = False
+    return (image.convert("RGB"), is_blank)
+
+def flatten_palette(palette):
+    flat_palette = []
+    for color in palette:
+        flat_palette += color[0:3]
     
-    return (image, is_blank)
+    return flat_palette
+
+paletted_png = False
+
+def image_from_column_major_pixels(pixels, palette, width, height):
+    # the buffer is the image lying on its side, so it's built sideways and flipped over in one go
+    image = Image.frombytes("P", (height, width), bytes(pixels))
+    image = image.transpose(Image.Transpose.TRANSPOSE)
 
+    image.putpalette(flatten_palette(palette))
 
-ega_palette = [
+    if paletted_png:
+        return image
+
+    return image.convert("RGB")
+
+
+ega_palette = palette_codec.Palette([
     (0x00, 0x00, 0x00), (0x00, 0x00, 0xaa),
     (0x00, 0xaa, 0x00), (0x00, 0xaa, 0xaa),
     (0xaa, 0x00, 0x00), (0xaa, 0x00, 0xaa),
@@ -401,7 +566,7 @@ ega_palette = [
     (0x55, 0xff, 0x55), (0x55, 0xff, 0xff),
     (0xff, 0x55, 0x55), (0xff, 0x55, 0xff),
     (0xff, 0xff, 0x55), (0xff, 0xff, 0xff),
-]
+])
 
 ega_palette_catppuccin = [
     (0x30, 0x34, 0x36), (0x54, 0x6e, 0xa9),
@@ -417,7 +582,7 @@ ega_palette_catppuccin = [
 
 
 
-zplane_palette = [(0x00, 0x00, 0x00), (0xff, 0xff, 0xff)]
+zplane_palette = palette_codec.Palette([(0x00, 0x00, 0x00), (0xff, 0xff, 0xff)])
 
 def decode_subimage(encoded_data, version, video_type, width, height, base_offset, palette=[]):
     if video_type == 'ega':
@@ -429,9 +594,14 @@ def decode_subimage(encoded_data, version, video_type, width, height, base_offse
 
     offset_table = decode_offset_table(encoded_data, width, word_size, base_offset)
 
-    stripes = decode_stripes(encoded_data, video_type, offset_table, width, height)
+    if video_type == 'zplane':
+        stripes = decode_zplane_stripes(encoded_data, offset_table, width, height)
+        return composite_zplane_from_stripes(stripes, width, height)
 
-    (image, is_blank) = composite_image_from_stripes(stripes, palette, width, height)
+    (pixels, decoded_lengths) = decode_stripes(encoded_data, video_type, offset_table, width, height)
+
+    image = image_from_column_major_pixels(pixels, palette, int(width / 8) * 8, height)
+    is_blank = pixels.count(0) == len(pixels)
 
     return (image, is_blank)
 
@@ -526,11 +696,34 @@ def unflatten_file_path(flattened_path):
 
     return unflattened_path
 
+def split_encoded_image_v4(encoded_data, image_type, video_type):
+    header_size = 8
+    if image_type == 'room':
+        header_size = 6
+    
+    word_size = word_size_table[video_type]
+
+    if len(encoded_data) <= header_size + 4:
+        return ([], [])
+    
+    image_start = header_size + word_size
+    image_end = le_decode(encoded_data[header_size:header_size + word_size], word_size) + header_size
+
+    encoded_smap = encoded_data[image_start:image_end]
+
+    if len(encoded_data) <= image_end + 4:
+        return (encoded_smap, [])
+    
+    encoded_zplane = encoded_data[image_end+2:]
+
+    return (encoded_smap, encoded_zplane)
+
 def decode(encoded_file_path, version, timestamp_manager, video_type, palette=[]):
     print(f"Decoding {encoded_file_path}")
 
+    # sliced as a view, so stripes aren't copied
     encoded_file = open(encoded_file_path, 'rb')
-    encoded_data = encoded_file.read()
+    encoded_data = memoryview(encoded_file.read())
     encoded_file.close()
 
     image_type = identify_image_type(encoded_file_path, version)
@@ -543,45 +736,41 @@ def decode(encoded_file_path, version, timestamp_manager, video_type, palette=[]
     header_size = 8
 
     if version == '4':
-        if image_type == 'room':
-            header_size = 6
-        
-        word_size = word_size_table[video_type]
-        
-        if len(encoded_data) <= header_size + 4:
+        (encoded_smap, encoded_zplane) = split_encoded_image_v4(encoded_data, image_type, video_type)
+
+        if encoded_smap == []:
             return
         
-        image_start = header_size + word_size
-        image_end = le_decode(encoded_data[header_size:header_size + word_size], word_size) + header_size
+        word_size = word_size_table[video_type]
 
-        (image, is_blank) = decode_subimage(encoded_data[image_start:image_end], version, video_type, width, height, word_size, palette)
+        (image, is_blank) = decode_subimage(encoded_smap, version, video_type, width, height, word_size, palette)
         
         image_file_path = Path(encoded_file_path.parent, encoded_file_path.name.replace(".dmp", "_image.png"))
 
         if image_type == 'object':
             image_file_path = flatten_file_path(image_file_path, 1)
         
-        image.save(image_file_path)
-
-        if timestamp_manager != []:
-            timestamp_manager.add_timestamp(image_file_path)
+        file_writer.save_image(image, image_file_path, timestamp_manager)
         
-        if len(encoded_data) <= image_end + 4:
+        if encoded_zplane == []:
             return
         
-        (zplane, is_blank) = decode_subimage(encoded_data[image_end+2:], version, 'zplane', width, height, 2)
+        if is_blank_subimage(encoded_zplane, 'zplane', width, height, 2):
+            return
+        
+        (zplane, is_blank) = decode_subimage(encoded_zplane, version, 'zplane', width, height, 2)
         
         if is_blank:
             return
         
         zplane_file_path = Path(image_file_path.parent, image_file_path.name.replace("_image", "_zplane"))
 
-        zplane.save(zplane_file_path)
-
-        if timestamp_manager != []:
-            timestamp_manager.add_timestamp(zplane_file_path)
+        file_writer.save_image(zplane, zplane_file_path, timestamp_manager)
 
     elif version == '5':
+        if is_blank_subimage(encoded_data[header_size:], video_type, width, height, header_size):
+            return
+
         (image, is_blank) = decode_subimage(encoded_data[header_size:], version, video_type, width, height, header_size, palette)
 
         if is_blank:
@@ -589,111 +778,288 @@ def decode(encoded_file_path, version, timestamp_manager, video_type, palette=[]
 
         image_file_path = Path(encoded_file_path.parent, encoded_file_path.name.replace(".dmp", ".png"))
         image_file_path = flatten_file_path(image_file_path, 2)
-        image.save(image_file_path)
+        file_writer.save_image(image, image_file_path, timestamp_manager)
 
-        if timestamp_manager != []:
-            timestamp_manager.add_timestamp(image_file_path)
 
 
 
+def remap_subimage(encoded_subimage, video_type, width, height, base_offset, color_table):
+    stripe_count = int(width / 8)
+    stripe_size = 8 * height
+    word_size = word_size_table[video_type]
+
+    offset_table = decode_offset_table(encoded_subimage, width, word_size, base_offset)
+    (pixels, decoded_lengths) = decode_stripes(encoded_subimage, video_type, offset_table, width, height)
+
+    remapped_pixels = pixels.translate(color_table)
+
+    if remapped_pixels == pixels:
+        return ([], 0)
+    
+    end_offsets = get_stripe_end_offsets(offset_table)
+
+    encoded_stripes = []
+    stripes_to_encode = []
+    stripe_indices = []
+
+    for i in range(stripe_count):
+        start = i * stripe_size
+
+        is_unchanged = remapped_pixels[start:start + stripe_size] == pixels[start:start + stripe_size]
+
+        # a stripe copying from its left neighbour also needs that neighbour's last column to stay the same
+        if is_unchanged and video_type == 'ega' and i > 0 and reads_previous_stripe(encoded_subimage[offset_table[i]:end_offsets[i]], height):
+            is_unchanged = remapped_pixels[start - height:start] == pixels[start - height:start]
+
+        # stripes without any of the remapped colors are kept byte for byte
+        if is_unchanged:
+            encoded_stripes.append(encoded_subimage[offset_table[i]:end_offsets[i]])
+        else:
+            encoded_stripes.append([])
+            stripes_to_encode.append(Stripe(height, remapped_pixels, start))
+            stripe_indices.append(i)
+    
+    reencoded_stripes = encode_stripes(stripes_to_encode, video_type)
+
+    for i in range(len(stripe_indices)):
+        encoded_stripes[stripe_indices[i]] = reencoded_stripes[i]
+    
+    encoded_subimage = pack_stripes_with_offsets(encoded_stripes, word_size, base_offset, dedupe_stripes)
+
+    return (encoded_subimage, len(stripes_to_encode))
+
+def remap(encoded_file_path, version, video_type, color_table):
+    encoded_file = open(encoded_file_path, 'rb')
+    encoded_data = memoryview(encoded_file.read())
+    encoded_file.close()
+
+    image_type = identify_image_type(encoded_file_path, version)
+
+    (width, height) = get_image_dimensions(encoded_file_path, version, image_type)
+
+    remapped_image = []
+    remapped_stripe_count = 0
+
+    if version == '4':
+        (encoded_smap, encoded_zplane) = split_encoded_image_v4(encoded_data, image_type, video_type)
+
+        if encoded_smap == []:
+            return 0
+        
+        word_size = word_size_table[video_type]
+
+        (remapped_smap, remapped_stripe_count) = remap_subimage(encoded_smap, video_type, width, height, word_size, color_table)
+
+        if remapped_stripe_count == 0:
+            return 0
+        
+        header_size = 8
+        if image_type == 'room':
+            header_size = 6
+        
+        # the header and the zplane that follows the smap are carried over as they are
+        image_end = le_decode(encoded_data[header_size:header_size + word_size], word_size) + header_size
+
+        remapped_image = list(encoded_data[4:header_size]) + le_encode(word_size + len(remapped_smap), word_size) + remapped_smap + list(encoded_data[image_end:])
+        remapped_image = le_encode(4 + len(remapped_image), 4) + remapped_image
+
+    elif version == '5':
+        (remapped_subimage, remapped_stripe_count) = remap_subimage(encoded_data[8:], video_type, width, height, 8, color_table)
+
+        if remapped_stripe_count == 0:
+            return 0
+        
+        remapped_image = list(encoded_data[0:4]) + be_encode(8 + len(remapped_subimage), 4) + remapped_subimage
+
+    print(f"Remapped {remapped_stripe_count} stripes of {encoded_file_path}")
+
+    encoded_file = open(encoded_file_path, 'wb')
+    encoded_file.write(bytes(remapped_image))
+    encoded_file.close()
+
+    return remapped_stripe_count
+
+def verify_subimage(encoded_subimage, version, video_type, width, height, base_offset, palette, subimage_name):
+    (image, is_blank) = decode_subimage(encoded_subimage, version, video_type, width, height, base_offset, palette)
+
+    reencoded_subimage = encode_subimage(image, version, video_type, base_offset, palette)
+    (reencoded_image, is_blank) = decode_subimage(bytes(reencoded_subimage), version, video_type, width, height, base_offset, palette)
+
+    if reencoded_image.tobytes() == image.tobytes():
+        return []
+    
+    mismatches = []
+
+    for i in range(int(width / 8)):
+        stripe_area = (i * 8, 0, i * 8 + 8, height)
+
+        if reencoded_image.crop(stripe_area).tobytes() != image.crop(stripe_area).tobytes():
+            mismatches.append(f"{subimage_name} stripe {i}")
+    
+    return mismatches
+
+def verify(encoded_file_path, version, video_type, palette=[]):
+    # decodes the image, encodes it again in memory and checks that decoding that gives the same pixels
+    encoded_file = open(encoded_file_path, 'rb')
+    encoded_data = memoryview(encoded_file.read())
+    encoded_file.close()
+
+    image_type = identify_image_type(encoded_file_path, version)
+
+    (width, height) = get_image_dimensions(encoded_file_path, version, image_type)
+
+    if video_type == 'vga' and palette == []:
+        palette = get_palette(encoded_file_path, version, image_type)
+    
+    mismatches = []
+
+    if version == '4':
+        (encoded_smap, encoded_zplane) = split_encoded_image_v4(encoded_data, image_type, video_type)
+
+        if encoded_smap != []:
+            mismatches += verify_subimage(encoded_smap, version, video_type, width, height, word_size_table[video_type], palette, "image")
+        
+        if encoded_zplane != []:
+            mismatches += verify_subimage(encoded_zplane, version, 'zplane', width, height, 2, [], "zplane")
+
+    elif version == '5':
+        subimage_name = "image"
+        if video_type == 'zplane':
+            subimage_name = "zplane"
+
+        mismatches += verify_subimage(encoded_data[8:], version, video_type, width, height, 8, palette, subimage_name)
+
+    return mismatches
+
+def get_column_major_indices(image, palette, origin=(0, 0)):
+    # paletted images already hold palette indices, so they're used as they are, unless some would spill out of the palette
+    if image.mode == "P" and image.getextrema()[1] < len(palette):
+        return bytearray(image.transpose(Image.Transpose.TRANSPOSE).tobytes())
+
+    # reading the image sideways gives its pixels column by column
+    width, height = image.size
+    colors = image.convert("RGB").transpose(Image.Transpose.TRANSPOSE).tobytes()
+
+    palette = palette_codec.get_palette(palette)
 
-def get_palette_index(color, palette):
-    for i in range(len(palette)):
-        if palette[i][0] == color[0] and palette[i][1] == color[1] and palette[i][2] == color[2]:
-            return i
+    pixels = bytearray(width * height)
+    palette_indices = {}
+    quantized_colors = set()
+
+    for i in range(width * height):
+        color = colors[i * 3:i * 3 + 3]
+
+        if not color in palette_indices:
+            if not palette.has_color(color):
+                quantized_colors.add(color)
+
+            palette_indices[color] = palette.get_index(color)
+
+        pixels[i] = palette_indices[color]
     
-    print("Error: Color not in palette")
-    exit()
+    if len(quantized_colors) > 0:
+        report_quantized_pixels(colors, quantized_colors, height, origin)
+
+    return pixels
+
+def report_quantized_pixels(colors, quantized_colors, height, origin):
+    quantized_pixel_count = 0
+    (left, top, right, bottom) = (-1, -1, -1, -1)
+
+    for i in range(int(len(colors) / 3)):
+        if not colors[i * 3:i * 3 + 3] in quantized_colors:
+            continue
+
+        quantized_pixel_count += 1
+
+        x = origin[0] + int(i / height)
+        y = origin[1] + i % height
+
+        if left == -1:
+            (left, top, right, bottom) = (x, y, x, y)
+        else:
+            (left, top, right, bottom) = (min(left, x), min(top, y), max(right, x), max(bottom, y))
+
+    palette_codec.quantized_pixel_count += quantized_pixel_count
+
+    print(f"Quantized {quantized_pixel_count} pixels of {len(quantized_colors)} off-palette colors to the nearest palette colors, from ({left}, {top}) to ({right}, {bottom})")
 
 def split_image_to_stripes(image, palette):
-    stripes = []
     width, height = image.size
 
+    pixels = get_column_major_indices(image, palette)
+    return split_pixels_to_stripes(pixels, width, height)
+
+def split_pixels_to_stripes(pixels, width, height):
+    stripes = []
+
     stripe_count = int(width / 8)
+    stripe_size = 8 * height
 
     for i in range(stripe_count):
-        stripe = Stripe(height, HORIZONTAL)
+        stripes.append(Stripe(height, pixels, i * stripe_size))
+    
+    return stripes
 
-        for y in range(height):
-            for x in range(8):
-                color = image.getpixel((i * 8 + x, y))
 
-                palette_index = get_palette_index(color, palette)
+def split_zplane_to_stripes(image):
+    width, height = image.size
 
-                stripe.write_color(palette_index)
-        
-        stripes.append(stripe)
+    stripe_count = int(width / 8)
+    row_length = int((width + 7) / 8)
+
+    # anything other than black and white goes through the palette, so it's refused or quantized like any other image
+    colors = image.convert("RGB").getcolors(2)
+    if colors is None or not all(zplane_palette.has_color(color) for (count, color) in colors):
+        mask = get_column_major_indices(image.convert("RGB"), zplane_palette)
+        image = Image.frombytes("L", (height, width), bytes(mask)).transpose(Image.Transpose.TRANSPOSE).point(lambda value: value * 255)
+
+    packed_rows = image.convert("1", dither=Image.Dither.NONE).tobytes()
+
+    stripes = []
+    for i in range(stripe_count):
+        stripes.append(ZplaneStripe(height, packed_rows[i::row_length]))
     
     return stripes
 
-
-UNDECIDED = 0
-REPEATING = 1
-NONREPEATING = 2
+run_pattern = re.compile(rb"(.)\1*", re.DOTALL)
 
 def encode_stripe_zplane(stripe):
-    stripe.reset(HORIZONTAL)
+    encoded_stripe = bytearray()
+    nonrepeating_bytes = bytearray()
 
-    bitmask_stripe = []
+    for run in run_pattern.finditer(stripe.pixels):
+        byte = stripe.pixels[run.start()]
+        run_length = run.end() - run.start()
 
-    for y in range(stripe.height):
-        row_bitmask = 0
+        if run_length >= 2:
+            if len(nonrepeating_bytes) > 0:
+                encoded_stripe.append(len(nonrepeating_bytes))
+                encoded_stripe += nonrepeating_bytes
+                nonrepeating_bytes = bytearray()
+
+            while run_length >= 2:
+                sequence_length = min(run_length, 0x7f)
 
-        for x in range(8):
-            row_bitmask = row_bitmask << 1
-            row_bitmask |= stripe.read_color()
-        
-        bitmask_stripe.append(row_bitmask)
-    
-    encoded_stripe = []
-    byte_buffer = []
-    sequence_length = 0
-    sequence_type = UNDECIDED
-
-    for byte in bitmask_stripe:
-        if sequence_type == UNDECIDED:
-            if sequence_length == 1 and byte_buffer[0] == byte:
-                sequence_type = REPEATING
-            elif sequence_length == 1 and byte_buffer[0] != byte:
-                sequence_type = NONREPEATING
-
-        elif sequence_type == REPEATING:
-            if byte != byte_buffer[0] or sequence_length == 0x7f:
                 encoded_stripe.append(sequence_length | 0x80)
-                encoded_stripe.append(byte_buffer[0])
+                encoded_stripe.append(byte)
 
-                byte_buffer = []
-                sequence_length = 0
-                sequence_type = UNDECIDED
+                run_length -= sequence_length
         
-        elif sequence_type == NONREPEATING:
-            if byte == byte_buffer[sequence_length - 1]:
-                encoded_stripe.append(sequence_length - 1)
-                encoded_stripe += byte_buffer[:sequence_length - 1]
-
-                byte_buffer = [byte]
-                sequence_length = 1
-                sequence_type = REPEATING
-
-            elif sequence_length == 0x7f:
-                encoded_stripe.append(sequence_length)
-                encoded_stripe += byte_buffer
-
-                byte_buffer = []
-                sequence_length = 0
-                sequence_type = UNDECIDED
-        
-        byte_buffer.append(byte)
-        sequence_length += 1
+        # a single byte left over from a long run gets grouped with the following bytes
+        if run_length == 1:
+            nonrepeating_bytes.append(byte)
+
+            if len(nonrepeating_bytes) == 0x7f:
+                encoded_stripe.append(len(nonrepeating_bytes))
+                encoded_stripe += nonrepeating_bytes
+                nonrepeating_bytes = bytearray()
     
-    if sequence_type == REPEATING:
-        encoded_stripe.append(sequence_length | 0x80)
-        encoded_stripe.append(byte_buffer[0])
-    elif sequence_type == NONREPEATING or sequence_type == UNDECIDED:
-        encoded_stripe.append(sequence_length)
-        encoded_stripe += byte_buffer
+    if len(nonrepeating_bytes) > 0:
+        encoded_stripe.append(len(nonrepeating_bytes))
+        encoded_stripe += nonrepeating_bytes
     
-    return encoded_stripe
+    return bytes(encoded_stripe)
 
 
 CAN_REPEAT = 1
@@ -730,7 +1096,8 @@ def encode_ega_sequence(buffer, possible_sequences):
 
 
 def encode_stripe_ega(stripe):
-    stripe.reset(VERTICAL)
+    pixels = stripe.read_columns()
+    height = stripe.height
 
     encoded_stripe = []
 
@@ -738,13 +1105,12 @@ def encode_stripe_ega(stripe):
     previous_byte_matched_previous_column = False
     buffer = []
 
-    while stripe.within_bounds():
-        (x, y) = (stripe.x, stripe.y)
-        color = stripe.read_color()
+    for i in range(len(pixels)):
+        color = pixels[i]
 
         possible_sequences = possible_sequences_on_previous_byte
 
-        color_matches_previous_column = x > 0 and color == stripe.read_color_at_coordinate(x - 1, y)
+        color_matches_previous_column = i >= height and color == pixels[i - height]
 
         if possible_sequences & CAN_REPEAT:
             if len(buffer) > 0 and color != buffer[len(buffer) - 1]:
@@ -799,11 +1165,157 @@ def encode_stripe_ega(stripe):
     return encoded_stripe
 
 
-def encode_stripe_vga(stripe, alt_algorithm, direction):
-    palette_index_size = 8
+def encode_stripe_ega_optimally(stripe):
+    pixels = stripe.read_columns()
+    height = stripe.height
+    pixel_count = len(pixels)
+
+    # lengths of the longest repeat, dither and copy runs starting at each pixel
+    repeat_runs = [0] * pixel_count
+    dither_runs = [0] * pixel_count
+    copy_runs = [0] * (pixel_count + 1)
+
+    i = pixel_count - 1
+    while i >= 0:
+        color = pixels[i]
+
+        if i + 1 < pixel_count and pixels[i + 1] == color:
+            repeat_runs[i] = repeat_runs[i + 1] + 1
+        else:
+            repeat_runs[i] = 1
+        
+        if i + 2 < pixel_count and pixels[i + 2] == color:
+            dither_runs[i] = dither_runs[i + 1] + 1
+        else:
+            dither_runs[i] = min(2, pixel_count - i)
+        
+        if i >= height and pixels[i - height] == color:
+            copy_runs[i] = copy_runs[i + 1] + 1
+        
+        i -= 1
+
+    # shortening the first run of an encoding never makes it longer, so the cost of encoding the
+    # remaining pixels never increases as the start moves forward. that means the longest run
+    # within each encoded length is always the best choice, and only those need to be compared
+    costs = [0] * (pixel_count + 1)
+    choices = [0] * pixel_count
+
+    i = pixel_count - 1
+    while i >= 0:
+        repeat_count = min(repeat_runs[i], 0b0111)
+        best_cost = 1 + costs[i + repeat_count]
+        best_choice = (CAN_REPEAT, repeat_count)
+
+        if repeat_runs[i] > 0b0111:
+            repeat_count = min(repeat_runs[i], 0xff)
+            cost = 2 + costs[i + repeat_count]
+
+            if cost < best_cost:
+                best_cost = cost
+                best_choice = (CAN_REPEAT, repeat_count)
+        
+        if dither_runs[i] >= 2:
+            repeat_count = min(dither_runs[i], 0b00111111)
+            cost = 2 + costs[i + repeat_count]
+
+            if cost < best_cost:
+                best_cost = cost
+                best_choice = (CAN_DITHER, repeat_count)
+            
+            if dither_runs[i] > 0b00111111:
+                repeat_count = min(dither_runs[i], 0xff)
+                cost = 3 + costs[i + repeat_count]
+
+                if cost < best_cost:
+                    best_cost = cost
+                    best_choice = (CAN_DITHER, repeat_count)
+        
+        if copy_runs[i] > 0:
+            repeat_count = min(copy_runs[i], 0b00111111)
+            cost = 1 + costs[i + repeat_count]
+
+            if cost < best_cost:
+                best_cost = cost
+                best_choice = (CAN_COPY, repeat_count)
+            
+            if copy_runs[i] > 0b00111111:
+                repeat_count = min(copy_runs[i], 0xff)
+                cost = 2 + costs[i + repeat_count]
+
+                if cost < best_cost:
+                    best_cost = cost
+                    best_choice = (CAN_COPY, repeat_count)
+        
+        costs[i] = best_cost
+        choices[i] = best_choice
+
+        i -= 1
+    
+    encoded_stripe = bytearray()
+
+    i = 0
+    while i < pixel_count:
+        (sequence, repeat_count) = choices[i]
+        encoded_stripe += bytes(encode_ega_sequence(pixels[i:i + repeat_count], sequence))
+
+        i += repeat_count
+    
+    return bytes(encoded_stripe)
+
+optimal_ega_encoding = True
+
+def get_color_runs(stripe, direction):
+    colors = []
+    if direction == VERTICAL:
+        colors = stripe.read_columns()
+    else:
+        colors = stripe.read_rows()
+    
+    runs = []
+    for run in run_pattern.finditer(colors):
+        runs.append((colors[run.start()], run.end() - run.start()))
+    
+    return runs
+
+def get_vga_palette_index_size(stripe, alt_algorithm, direction):
+    runs = get_color_runs(stripe, direction)
+
+    # only colors written with an explicit set command need to fit in the index width,
+    # colors reached by shifting are unconstrained
+    largest_set_color = 0
+
+    for i in range(1, len(runs)):
+        color = runs[i][0]
+        difference = color - runs[i - 1][0]
+
+        if alt_algorithm:
+            can_shift = difference >= -4 and difference < 4
+        else:
+            can_shift = abs(difference) == 1
+
+        if not can_shift and color > largest_set_color:
+            largest_set_color = color
+
+    # the engine only accepts index widths from 4 to 8 bits
+    return max(4, largest_set_color.bit_length())
+
+def write_vga_repeat(bitstream, repeat_count, alt_algorithm):
+    if alt_algorithm and repeat_count > 13 and repeat_count < 32:
+        bitstream.write_bit(1)
+        bitstream.write_bit(1)
+        bitstream.write_integer(0b100, 3)
+
+        bitstream.write_integer(repeat_count, 5) #seems to only be able to handle 5 bits?
+
+        bitstream.write_bit(0)
+        bitstream.write_bit(0)
+        bitstream.write_bit(0)
+    else:
+        bitstream.write_zero_bits(repeat_count)
 
-    stripe.reset(direction)
-    current_color = stripe.read_color()
+def encode_stripe_vga(stripe, alt_algorithm, direction, palette_index_size=8):
+    runs = get_color_runs(stripe, direction)
+    (current_color, run_length) = runs[0]
 
     key = 10 + palette_index_size
     if direction == HORIZONTAL:
@@ -816,108 +1328,317 @@ def encode_stripe_vga(stripe, alt_algorithm, direction):
     bitstream.write_integer(key, 8)
     bitstream.write_integer(current_color, 8)
 
-    repeat_count = 0
+    repeat_count = run_length - 1
     color_shift = -1
 
-    while stripe.within_bounds():
-        color = stripe.read_color()
+    for (color, run_length) in runs[1:]:
+        write_vga_repeat(bitstream, repeat_count, alt_algorithm)
 
-        if color == current_color:
-            repeat_count += 1
-        else:
-            if alt_algorithm and repeat_count > 13 and repeat_count < 32:
-                bitstream.write_bit(1)
-                bitstream.write_bit(1)
-                bitstream.write_integer(0b100, 3)
+        bitstream.write_bit(1)
 
-                bitstream.write_integer(repeat_count, 5) #seems to only be able to handle 5 bits?
+        difference = color - current_color
 
-                bitstream.write_bit(0)
-                bitstream.write_bit(0)
+        if alt_algorithm and difference >= -4 and difference < 4:
+            bitstream.write_bit(1)
+            bitstream.write_integer(difference + 4, 3)
+        elif (not alt_algorithm) and abs(difference) == 1:
+            bitstream.write_bit(1)
+
+            if difference == color_shift:
                 bitstream.write_bit(0)
             else:
-                for i in range(repeat_count):
-                    bitstream.write_bit(0)
+                bitstream.write_bit(1)
+                color_shift = difference
+        else:
+            bitstream.write_bit(0)
+            bitstream.write_integer(color, palette_index_size)
+            color_shift = -1
 
-            repeat_count = 0
-            bitstream.write_bit(1)
+        current_color = color
+        repeat_count = run_length - 1
 
-            difference = color - current_color
+    write_vga_repeat(bitstream, repeat_count, alt_algorithm)
 
-            if alt_algorithm and difference >= -4 and difference < 4:
-                bitstream.write_bit(1)
-                bitstream.write_integer(difference + 4, 3)
-            elif (not alt_algorithm) and abs(difference) == 1:
-                bitstream.write_bit(1)
+    return bitstream.data
 
-                if difference == color_shift:
-                    bitstream.write_bit(0)
-                else:
-                    bitstream.write_bit(1)
-                    color_shift = difference
-            else:
-                bitstream.write_bit(0)
-                bitstream.write_integer(color, palette_index_size)
-                color_shift = -1
+vga_variants = [
+    #(True, VERTICAL), #this variation might not be valid in-engine, remove if so
+    (True, HORIZONTAL),
+    (False, VERTICAL),
+    (False, HORIZONTAL)
+]
 
-            current_color = color
+def encode_stripe_vga_optimally(stripe):
+    smallest_attempt = []
 
-    if alt_algorithm and repeat_count > 13 and repeat_count < 32:
-        bitstream.write_bit(1)
-        bitstream.write_bit(1)
-        bitstream.write_integer(0b100, 3)
+    for (alt_algorithm, direction) in vga_variants:
+        palette_index_size = get_vga_palette_index_size(stripe, alt_algorithm, direction)
+        attempt = encode_stripe_vga(stripe, alt_algorithm, direction, palette_index_size)
 
-        bitstream.write_integer(repeat_count, 5)
+        if smallest_attempt == [] or len(attempt) < len(smallest_attempt):
+            smallest_attempt = attempt
+    
+    return smallest_attempt
+
+
+def decode_previous_stripes(encoded_data, video_type, stripe_count, height, base_offset):
+    word_size = word_size_table[video_type]
+    offset_table_length = word_size * stripe_count
+
+    if len(encoded_data) < offset_table_length:
+        return []
+
+    offset_table = decode_offset_table(encoded_data, stripe_count * 8, word_size, base_offset)
+
+    # the stripe data directly follows the offset table, so a different first offset means the image was resized
+    if offset_table[0] != offset_table_length:
+        return []
+    
+    for offset in offset_table:
+        if offset < offset_table_length or offset > len(encoded_data):
+            return []
+    
+    previous_stripes = []
+
+    end_offsets = get_stripe_end_offsets(offset_table)
+
+    # a stripe that ran out of data before filling up would read past its end in-engine, so it can't be reused
+    if video_type == 'zplane':
+        stripes = decode_zplane_stripes(encoded_data, offset_table, stripe_count * 8, height)
+
+        for i in range(stripe_count):
+            decoded_pixels = []
+            if not stripes[i].within_bounds():
+                decoded_pixels = stripes[i].pixels
+            
+            previous_stripes.append((encoded_data[offset_table[i]:end_offsets[i]], decoded_pixels))
     
-        bitstream.write_bit(0)
-        bitstream.write_bit(0)
-        bitstream.write_bit(0)
     else:
-        for i in range(repeat_count):
-            bitstream.write_bit(0)
+        (pixels, decoded_lengths) = decode_stripes(encoded_data, video_type, offset_table, stripe_count * 8, height)
+        stripe_size = 8 * height
 
-    return bitstream.data
+        for i in range(stripe_count):
+            decoded_pixels = []
+            if decoded_lengths[i] == stripe_size:
+                decoded_pixels = bytes(pixels[i * stripe_size:(i + 1) * stripe_size])
+            
+            previous_stripes.append((encoded_data[offset_table[i]:end_offsets[i]], decoded_pixels))
+    
+    return previous_stripes
 
-def encode_stripe_vga_optimally(stripe):
-    attempts = []
+class StripeCache:
+    # bumped whenever an encoder's output changes, so entries left on disk by an older encoder aren't reused
+    encoder_version = 1
 
-    #attempts.append(encode_stripe_vga(stripe, True, VERTICAL)) #this variation might not be valid in-engine, remove if so
-    attempts.append(encode_stripe_vga(stripe, True, HORIZONTAL))
-    attempts.append(encode_stripe_vga(stripe, False, VERTICAL))
-    attempts.append(encode_stripe_vga(stripe, False, HORIZONTAL))
+    max_entries = 4096
+    disk_path = ""
 
-    smallest_size = 1000000
-    smallest_index = -1
+    entries = {}
 
-    for i in range(3):
-        attempt_size = len(attempts[i])
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.disk_path = ""
+        self.entries = OrderedDict()
+    
+    def get_key(self, stripe, video_type):
+        if video_type == 'ega' and not optimal_ega_encoding:
+            video_type = 'ega_fast'
+
+        stripe_hash = hashlib.blake2b(digest_size=16)
+        stripe_hash.update(f"{self.encoder_version}:{video_type}:{stripe.height}:".encode())
+        stripe_hash.update(get_stripe_pixels(stripe, video_type))
 
-        if attempt_size < smallest_size or smallest_index == -1:
-            smallest_size = attempt_size
-            smallest_index = i
+        return stripe_hash.hexdigest()
     
-    return attempts[smallest_index]
+    def get_disk_entry_path(self, key):
+        return Path(self.disk_path, key[:2], key + ".bin")
 
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        
+        if self.disk_path == "":
+            return None
+        
+        entry_path = self.get_disk_entry_path(key)
 
-def encode_stripes(stripes, video_type):
+        if not entry_path.is_file():
+            return None
+        
+        entry_file = open(entry_path, 'rb')
+        encoded_stripe = entry_file.read()
+        entry_file.close()
+
+        self.add_to_memory(key, encoded_stripe)
+
+        return encoded_stripe
+
+    def add(self, key, encoded_stripe):
+        self.add_to_memory(key, encoded_stripe)
+
+        if self.disk_path == "":
+            return
+        
+        entry_path = self.get_disk_entry_path(key)
+
+        if entry_path.is_file():
+            return
+        
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # other workers may be reading the same entry, so it only appears once it's complete
+        temp_path = Path(entry_path.parent, f"{key}.{os.getpid()}.tmp")
+        entry_file = open(temp_path, 'wb')
+        entry_file.write(encoded_stripe)
+        entry_file.close()
+
+        os.replace(temp_path, entry_path)
+    
+    def add_to_memory(self, key, encoded_stripe):
+        self.entries[key] = encoded_stripe
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+stripe_cache = StripeCache(4096)
+
+def encode_stripe(stripe, video_type):
+    encoded_stripe = []
+
+    if video_type == 'ega' and optimal_ega_encoding:
+        encoded_stripe = encode_stripe_ega_optimally(stripe)
+    elif video_type == 'ega':
+        encoded_stripe = encode_stripe_ega(stripe)
+    elif video_type == 'vga':
+        encoded_stripe = encode_stripe_vga_optimally(stripe)
+    elif video_type == 'zplane':
+        encoded_stripe = encode_stripe_zplane(stripe)
+    
+    return bytes(encoded_stripe)
+
+def get_stripe_pixels(stripe, video_type):
+    if video_type == 'zplane':
+        return stripe.pixels
+    
+    return stripe.read_columns()
+
+def make_stripe(pixels, height, video_type):
+    if video_type == 'zplane':
+        return ZplaneStripe(height, pixels)
+    
+    return Stripe(height, pixels)
+
+def encode_stripe_chunk(stripe_pixels, height, video_type, use_optimal_ega_encoding):
+    # worker processes don't see the settings made in the main one, so the one that matters is passed along
+    global optimal_ega_encoding
+    optimal_ega_encoding = use_optimal_ega_encoding
+
+    stripe_size = 8 * height
+    if video_type == 'zplane':
+        stripe_size = height
+    
     encoded_stripes = []
 
-    for stripe in stripes:
+    for start in range(0, len(stripe_pixels), stripe_size):
+        stripe = make_stripe(stripe_pixels[start:start + stripe_size], height, video_type)
+        encoded_stripes.append(encode_stripe(stripe, video_type))
+    
+    return encoded_stripes
 
-        encoded_stripe = []
+stripe_pool = None
+stripe_pool_size = 0
+parallel_encoding_min_width = 640
 
-        if video_type == 'ega':
-            encoded_stripe = encode_stripe_ega(stripe)
-        elif video_type == 'vga':
-            encoded_stripe = encode_stripe_vga_optimally(stripe)
-        elif video_type == 'zplane':
-            encoded_stripe = encode_stripe_zplane(stripe)
+def encode_stripes_in_parallel(stripes, video_type):
+    chunk_count = min(stripe_pool_size, len(stripes))
+    chunk_length = math.ceil(len(stripes) / chunk_count)
+
+    # each worker gets a run of neighbouring stripes as one buffer, the same way they're laid out in the image
+    pending_chunks = []
+
+    for start in range(0, len(stripes), chunk_length):
+        stripe_pixels = bytearray()
+        for stripe in stripes[start:start + chunk_length]:
+            stripe_pixels += get_stripe_pixels(stripe, video_type)
         
-        encoded_stripes.append(encoded_stripe)
+        pending_chunks.append(stripe_pool.submit(encode_stripe_chunk, bytes(stripe_pixels), stripes[0].height, video_type, optimal_ega_encoding))
+    
+    encoded_stripes = []
+    for pending_chunk in pending_chunks:
+        encoded_stripes += pending_chunk.result()
+    
+    return encoded_stripes
+
+def reads_changed_column(stripes, previous_stripes, i, video_type):
+    # an ega stripe can copy the last column of its left neighbour, so that column has to look the same as before
+    if video_type != 'ega' or i == 0:
+        return False
+    
+    height = stripes[i].height
+
+    if not reads_previous_stripe(previous_stripes[i][0], height):
+        return False
+    
+    previous_left_pixels = previous_stripes[i - 1][1]
+    if previous_left_pixels == []:
+        return True
+    
+    return previous_left_pixels[-height:] != get_stripe_pixels(stripes[i - 1], video_type)[-height:]
+
+def encode_stripes(stripes, video_type, previous_stripes=[]):
+    encoded_stripes = [None] * len(stripes)
+
+    keys_to_encode = []
+    stripes_to_encode = []
+    stripe_indices_by_key = {}
+
+    for i in range(len(stripes)):
+        stripe = stripes[i]
+
+        if i < len(previous_stripes):
+            (previous_encoded_stripe, previous_pixels) = previous_stripes[i]
+
+            if previous_pixels != [] and previous_pixels == get_stripe_pixels(stripe, video_type) and not reads_changed_column(stripes, previous_stripes, i, video_type):
+                encoded_stripes[i] = previous_encoded_stripe
+                continue
+
+        key = stripe_cache.get_key(stripe, video_type)
+
+        if key in stripe_indices_by_key:
+            stripe_indices_by_key[key].append(i)
+            continue
+
+        encoded_stripe = stripe_cache.get(key)
+
+        if encoded_stripe is None:
+            keys_to_encode.append(key)
+            stripes_to_encode.append(stripe)
+            stripe_indices_by_key[key] = [i]
+        else:
+            encoded_stripes[i] = encoded_stripe
+    
+    # small images aren't worth the trip to another process
+    new_encoded_stripes = []
+    if stripe_pool is not None and len(stripes) * 8 >= parallel_encoding_min_width and len(stripes_to_encode) > 1:
+        new_encoded_stripes = encode_stripes_in_parallel(stripes_to_encode, video_type)
+    else:
+        for stripe in stripes_to_encode:
+            new_encoded_stripes.append(encode_stripe(stripe, video_type))
+    
+    for i in range(len(keys_to_encode)):
+        key = keys_to_encode[i]
+        stripe_cache.add(key, new_encoded_stripes[i])
+
+        for stripe_index in stripe_indices_by_key[key]:
+            encoded_stripes[stripe_index] = new_encoded_stripes[i]
     
     return encoded_stripes
 
-def pack_stripes_with_offsets(encoded_stripes, word_size, base_offset):
+dedupe_stripes = False
+
+def pack_stripes_with_offsets(encoded_stripes, word_size, base_offset, dedupe=False):
     encoded_subimage = []
     offset_table = []
 
@@ -926,7 +1647,18 @@ def pack_stripes_with_offsets(encoded_stripes, word_size, base_offset):
 
     offset = base_offset + offset_table_length
 
+    stripe_offsets = {}
+
     for encoded_stripe in encoded_stripes:
+        if dedupe:
+            stripe_key = bytes(encoded_stripe)
+
+            if stripe_key in stripe_offsets:
+                offset_table += le_encode(stripe_offsets[stripe_key], word_size)
+                continue
+
+            stripe_offsets[stripe_key] = offset
+
         offset_table += le_encode(offset, word_size)
         offset += len(encoded_stripe)
 
@@ -936,30 +1668,86 @@ def pack_stripes_with_offsets(encoded_stripes, word_size, base_offset):
 
     return encoded_subimage
 
-def encode_subimage(image, version, video_type, base_offset, palette=[]):
+def encode_subimage(image, version, video_type, base_offset, palette=[], previous_encoded_subimage=[]):
+
+    stripes = []
 
     if video_type == 'ega':
-        palette = ega_palette
+        stripes = split_image_to_stripes(image, ega_palette)
+    elif video_type == 'vga':
+        stripes = split_image_to_stripes(image, palette)
     elif video_type == 'zplane':
-        palette = zplane_palette
+        stripes = split_zplane_to_stripes(image)
 
-    stripes = split_image_to_stripes(image, palette)
+    previous_stripes = []
+    if len(previous_encoded_subimage) > 0:
+        previous_stripes = decode_previous_stripes(previous_encoded_subimage, video_type, len(stripes), image.height, base_offset)
 
-    encoded_stripes = encode_stripes(stripes, video_type)
+    encoded_stripes = encode_stripes(stripes, video_type, previous_stripes)
 
     word_size = word_size_table[video_type]
-    encoded_subimage = pack_stripes_with_offsets(encoded_stripes, word_size, base_offset)
+    encoded_subimage = pack_stripes_with_offsets(encoded_stripes, word_size, base_offset, dedupe_stripes)
 
     return encoded_subimage
 
-def generate_blank_image(width, height):
-    image = Image.new(mode = "RGB", size = (width, height))
+def get_stripe_variant(stripe_key):
+    if stripe_key == 1:
+        return "uncompressed"
+
+    direction = "horizontal"
+    if math.floor(stripe_key / 10) % 2 == VERTICAL:
+        direction = "vertical"
+
+    algorithm = "basic"
+    if stripe_key >= 50:
+        algorithm = "alt"
+
+    return f"{algorithm} {direction} {stripe_key % 10}-bit"
 
-    for y in range(height):
-        for x in range(width):
-            image.putpixel((x, y), (0, 0, 0))
+def get_stripe_variants(encoded_subimage, width, base_offset):
+    # only vga stripes come in several variants, told apart by their first byte
+    offset_table = decode_offset_table(encoded_subimage, width, word_size_table['vga'], base_offset)
+
+    stripe_variants = []
+    for offset in offset_table[:-1]:
+        stripe_variants.append(get_stripe_variant(encoded_subimage[offset]))
+
+    return stripe_variants
+
+def get_size_report_details(encoded_subimage, video_type, width, base_offset):
+    if video_type != 'vga':
+        return {}
+
+    stripe_variants = get_stripe_variants(encoded_subimage, width, base_offset)
+
+    stripe_variant_counts = {}
+    for stripe_variant in stripe_variants:
+        stripe_variant_counts[stripe_variant] = stripe_variant_counts.get(stripe_variant, 0) + 1
+
+    return {
+        "stripe_variants": stripe_variants,
+        "stripe_variant_counts": stripe_variant_counts
+    }
+
+blank_zplanes = {}
+
+def encode_blank_zplane(width, height, base_offset, previous_encoded_zplane=[]):
+    stripe_count = int(width / 8)
+
+    if len(previous_encoded_zplane) > 0:
+        stripes = [ZplaneStripe(height, bytes(height))] * stripe_count
+        previous_stripes = decode_previous_stripes(previous_encoded_zplane, 'zplane', stripe_count, height, base_offset)
+
+        encoded_stripes = encode_stripes(stripes, 'zplane', previous_stripes)
+        return pack_stripes_with_offsets(encoded_stripes, 2, base_offset, dedupe_stripes)
+
+    key = (stripe_count, height, base_offset, dedupe_stripes)
+
+    if not key in blank_zplanes:
+        encoded_stripe = encode_stripe_zplane(ZplaneStripe(height, bytes(height)))
+        blank_zplanes[key] = pack_stripes_with_offsets([encoded_stripe] * stripe_count, 2, base_offset, dedupe_stripes)
     
-    return image
+    return blank_zplanes[key]
 
 def find_matching_files_v4(file_path):
     if "_image" in file_path.name:
@@ -971,6 +1759,22 @@ def find_matching_files_v4(file_path):
         return (image_path, file_path)
 
 
+reuse_previous_stripes = True
+
+def read_previous_subimages(encoded_file_path, version, image_type, video_type):
+    if not reuse_previous_stripes or not encoded_file_path.is_file():
+        return ([], [])
+    
+    encoded_file = open(encoded_file_path, 'rb')
+    encoded_data = memoryview(encoded_file.read())
+    encoded_file.close()
+
+    if version == '4':
+        return split_encoded_image_v4(encoded_data, image_type, video_type)
+    elif version == '5':
+        return (encoded_data[8:], [])
+
+
 room_image_header_v4 = [0x42, 0x4d]
 object_image_header_v4 = [0x4f, 0x49]
 image_header_v5 = [0x53, 0x4d, 0x41, 0x50]
@@ -987,6 +1791,14 @@ def encode(image_file_path, version, timestamp_manager, video_type, palette=[]):
     if video_type == 'vga' and palette == []:
         palette = get_palette(encoded_file_path, version, image_type)
 
+    (previous_encoded_subimage, previous_encoded_zplane) = read_previous_subimages(encoded_file_path, version, image_type, video_type)
+
+    original_size = None
+    if size_report.enabled and encoded_file_path.is_file():
+        original_size = encoded_file_path.stat().st_size
+
+    report_details = {}
+
     if version == '4':
         (image_file_path, zplane_file_path) = find_matching_files_v4(image_file_path)
 
@@ -997,15 +1809,14 @@ def encode(image_file_path, version, timestamp_manager, video_type, palette=[]):
         
         image = Image.open(image_file_path)
         word_size = word_size_table[video_type]
-        encoded_smap = encode_subimage(image, version, video_type, word_size, palette)
+        encoded_smap = encode_subimage(image, version, video_type, word_size, palette, previous_encoded_subimage)
 
-        zplane = []
+        encoded_zplane = []
         if zplane_file_path.exists():
             zplane = Image.open(zplane_file_path)
+            encoded_zplane = encode_subimage(zplane, version, 'zplane', 2, [], previous_encoded_zplane)
         else:
-            zplane = generate_blank_image(image.width, image.height)
-        
-        encoded_zplane = encode_subimage(zplane, version, 'zplane', 2)
+            encoded_zplane = encode_blank_zplane(image.width, image.height, 2, previous_encoded_zplane)
 
         header = []
         if image_type == 'object':
@@ -1021,6 +1832,9 @@ def encode(image_file_path, version, timestamp_manager, video_type, palette=[]):
 
         encoded_image = le_encode(encoded_image_length, 4) + header + le_encode(smap_length, word_size) + encoded_smap + le_encode(zplane_length, 2) + encoded_zplane
 
+        if size_report.enabled:
+            report_details = get_size_report_details(encoded_smap, video_type, image.width, word_size)
+
         if timestamp_manager != []:
             timestamp_manager.add_timestamp(image_file_path)
             if zplane_file_path.exists():
@@ -1031,7 +1845,7 @@ def encode(image_file_path, version, timestamp_manager, video_type, palette=[]):
 
         image = Image.open(image_file_path)
 
-        encoded_subimage = encode_subimage(image, version, video_type, 8, palette)
+        encoded_subimage = encode_subimage(image, version, video_type, 8, palette, previous_encoded_subimage)
 
         header = []
         if video_type == 'vga':
@@ -1049,6 +1863,9 @@ def encode(image_file_path, version, timestamp_manager, video_type, palette=[]):
 
         encoded_image = header + be_encode(encoded_image_length, 4) + encoded_subimage
 
+        if size_report.enabled:
+            report_details = get_size_report_details(encoded_subimage, video_type, image.width, 8)
+
         if timestamp_manager != []:
             timestamp_manager.add_timestamp(image_file_path)
 
@@ -1056,6 +1873,83 @@ def encode(image_file_path, version, timestamp_manager, video_type, palette=[]):
     encoded_file.write(bytes(encoded_image))
     encoded_file.close()
 
+    if size_report.enabled:
+        asset_type = f"{image_type} image"
+        if version == '5' and video_type == 'zplane':
+            asset_type = f"{image_type} zplane"
+
+        size_report.add_asset(encoded_file_path, asset_type, original_size, len(encoded_image), report_details)
+
+def benchmark_stripe_encoders(encoded_file_path, version, video_type):
+    encoded_file = open(encoded_file_path, 'rb')
+    encoded_data = encoded_file.read()
+    encoded_file.close()
+
+    image_type = identify_image_type(encoded_file_path, version)
+    (width, height) = get_image_dimensions(encoded_file_path, version, image_type)
+
+    word_size = word_size_table[video_type]
+
+    encoded_subimage = []
+    base_offset = 8
+
+    if version == '4':
+        (encoded_subimage, encoded_zplane) = split_encoded_image_v4(encoded_data, image_type, video_type)
+        base_offset = word_size
+    elif version == '5':
+        encoded_subimage = encoded_data[8:]
+
+    offset_table = decode_offset_table(encoded_subimage, width, word_size, base_offset)
+
+    stripes = []
+    if video_type == 'zplane':
+        stripes = decode_zplane_stripes(encoded_subimage, offset_table, width, height)
+    else:
+        (pixels, decoded_lengths) = decode_stripes(encoded_subimage, video_type, offset_table, width, height)
+        stripes = split_pixels_to_stripes(pixels, width, height)
+
+    encoders = []
+    if video_type == 'ega':
+        encoders = [("greedy", encode_stripe_ega), ("optimal", encode_stripe_ega_optimally)]
+    elif video_type == 'vga':
+        encoders = [("optimal", encode_stripe_vga_optimally)]
+    elif video_type == 'zplane':
+        encoders = [("rle", encode_stripe_zplane)]
+
+    print(f"{encoded_file_path}: {len(stripes)} stripes, {len(encoded_subimage) - word_size * len(stripes)} bytes originally")
+
+    for (encoder_name, encoder) in encoders:
+        start_time = time.time()
+
+        encoded_stripes = []
+        for stripe in stripes:
+            encoded_stripes.append(bytes(encoder(stripe)))
+        
+        encode_time = time.time() - start_time
+
+        encoded_size = 0
+        mismatch_count = 0
+
+        for i in range(len(stripes)):
+            encoded_size += len(encoded_stripes[i])
+
+            decoded_pixels = []
+            if video_type == 'zplane':
+                decoded_pixels = decode_stripe_zplane(encoded_stripes[i], height).pixels
+            else:
+                # each stripe is decoded on its own, which is fine as the encoders never copy from the stripe before
+                decoded_stripe = Stripe(height)
+                if video_type == 'ega':
+                    decode_stripe_ega(encoded_stripes[i], decoded_stripe)
+                elif video_type == 'vga':
+                    decode_stripe_vga(encoded_stripes[i], decoded_stripe)
+                decoded_pixels = decoded_stripe.read_columns()
+
+            if decoded_pixels != get_stripe_pixels(stripes[i], video_type):
+                print(f"Stripe {i} doesn't survive a round trip through the {encoder_name} encoder")
+                mismatch_count += 1
+
+        print(f"{encoder_name}: {encoded_size} bytes in {encode_time:.3f} seconds, {mismatch_count} mismatched stripes")
 
 if __name__ == "__main__":
     if sys.argv[1] == "decode":
@@ -1064,4 +1958,7 @@ if __name__ == "__main__":
     elif sys.argv[1] == "encode":
         encode(Path(sys.argv[2]).resolve(), sys.argv[3], [], sys.argv[4])
 
+    elif sys.argv[1] == "benchmark":
+        benchmark_stripe_encoders(Path(sys.argv[2]).resolve(), sys.argv[3], sys.argv[4])
+
 
@@ -1,8 +1,106 @@
 import os, sys, timestamp_manager
 from PIL import Image
+from file_writer import file_writer
 from pathlib import Path
 
-def save_to_png(palette, png_path):
+quantize_modes = ["exact", "nearest"]
+quantize_mode = "exact"
+quantized_pixel_count = 0
+
+class Palette(list):
+    # a list of colors that also maps each color back to its index, built the first time one is looked up
+    color_indices = None
+    global_color_indices = None
+    nearest_color_tables = None
+
+    def get_index_order(self, first_index):
+        # lower indices win, counting up from first_index and then wrapping round to 0
+        return list(range(first_index, len(self))) + list(range(min(first_index, len(self))))
+
+    def index_colors(self, first_index):
+        color_indices = {}
+
+        for i in self.get_index_order(first_index):
+            color = tuple(self[i][0:3])
+
+            if not color in color_indices:
+                color_indices[color] = i
+        
+        return color_indices
+
+    def has_color(self, color):
+        if self.color_indices is None:
+            self.color_indices = self.index_colors(0)
+        
+        return tuple(color[0:3]) in self.color_indices
+
+    def get_index(self, color):
+        if self.color_indices is None:
+            self.color_indices = self.index_colors(0)
+        
+        return self.find_index(self.color_indices, color, 0)
+
+    def get_index_prioritising_global_colors(self, color):
+        # the colors from 0xc0 up are the same in every room, so they're picked over a room's own copy
+        if self.global_color_indices is None:
+            self.global_color_indices = self.index_colors(0xc0)
+        
+        return self.find_index(self.global_color_indices, color, 0xc0)
+
+    def find_index(self, color_indices, color, first_index):
+        color = tuple(color[0:3])
+
+        if color in color_indices:
+            return color_indices[color]
+        
+        if quantize_mode == "nearest":
+            return self.get_nearest_index(color, first_index)
+        
+        print("Error: Color not in palette")
+        exit()
+
+    def get_nearest_index(self, color, first_index):
+        if self.nearest_color_tables is None:
+            self.nearest_color_tables = {}
+        
+        if not first_index in self.nearest_color_tables:
+            self.nearest_color_tables[first_index] = [-1] * (32 * 32 * 32)
+        
+        nearest_color_table = self.nearest_color_tables[first_index]
+
+        # each cell covers 8 levels of red, green and blue, and is worked out the first time a color lands in it
+        cell = ((color[0] >> 3) << 10) | ((color[1] >> 3) << 5) | (color[2] >> 3)
+
+        if nearest_color_table[cell] == -1:
+            cell_color = ((color[0] & 0xf8) | 4, (color[1] & 0xf8) | 4, (color[2] & 0xf8) | 4)
+            nearest_color_table[cell] = self.find_nearest_index(cell_color, first_index)
+        
+        return nearest_color_table[cell]
+
+    def find_nearest_index(self, color, first_index):
+        nearest_index = -1
+        nearest_distance = 0
+
+        for i in self.get_index_order(first_index):
+            red_distance = self[i][0] - color[0]
+            green_distance = self[i][1] - color[1]
+            blue_distance = self[i][2] - color[2]
+
+            distance = red_distance * red_distance + green_distance * green_distance + blue_distance * blue_distance
+
+            if nearest_index == -1 or distance < nearest_distance:
+                nearest_index = i
+                nearest_distance = distance
+        
+        return nearest_index
+
+def get_palette(colors):
+    if isinstance(colors, Palette):
+        return colors
+    
+    return Palette(colors)
+
+def save_to_png(palette, png_path, timestamp_manager):
     palette_image = Image.new(mode="RGB", size=(16,16))
 
     for y in range(16):
@@ -10,17 +108,10 @@ def save_to_png(palette, png_path):
             color = palette[y * 16 + x]
             palette_image.putpixel((x, y), color)
     
-    palette_image.save(png_path)
+    file_writer.save_image(palette_image, png_path, timestamp_manager)
 
-def decode(encoded_file_path, version, timestamp_manager, save_to_file=True):
-    if save_to_file:
-        print(f"Decoding {encoded_file_path}")
-
-    encoded_file = open(encoded_file_path, 'rb')
-    encoded_data = encoded_file.read()
-    encoded_file.close()
-
-    palette = []
+def decode_data(encoded_data, version):
+    palette = Palette()
     
     p = 0
     if version == '4':
@@ -34,17 +125,26 @@ def decode(encoded_file_path, version, timestamp_manager, save_to_file=True):
         palette.append(color)
         p += 3
     
+    return palette
+
+def decode(encoded_file_path, version, timestamp_manager, save_to_file=True):
+    if save_to_file:
+        print(f"Decoding {encoded_file_path}")
+
+    encoded_file = open(encoded_file_path, 'rb')
+    encoded_data = encoded_file.read()
+    encoded_file.close()
+
+    palette = decode_data(encoded_data, version)
+    
     if save_to_file:
         decoded_file_path = Path(encoded_file_path.parent, encoded_file_path.name.replace(".dmp", ".png"))
-        save_to_png(palette, decoded_file_path)
-
-        if timestamp_manager != []:
-            timestamp_manager.add_timestamp(decoded_file_path)
+        save_to_png(palette, decoded_file_path, timestamp_manager)
 
     return palette
 
 def get_palette_from_png(png_file_path):
-    palette = []
+    palette = Palette()
 
     image_file = Image.open(png_file_path)
     palette_image = image_file.load()
@@ -56,14 +156,7 @@ def get_palette_from_png(png_file_path):
     
     return palette
 
-def encode(png_file_path, version, timestamp_manager, save_to_file=True):
-    palette = get_palette_from_png(png_file_path)
-
-    if not save_to_file:
-        return palette
-    
-    print(f"Encoding {png_file_path}")
-
+def encode_data(palette, version):
     encoded_data = []
 
     if version == "4":
@@ -78,6 +171,18 @@ def encode(png_file_path, version, timestamp_manager, save_to_file=True):
         encoded_data.append(color[0])
         encoded_data.append(color[1])
         encoded_data.append(color[2])
+    
+    return encoded_data
+
+def encode(png_file_path, version, timestamp_manager, save_to_file=True):
+    palette = get_palette_from_png(png_file_path)
+
+    if not save_to_file:
+        return palette
+    
+    print(f"Encoding {png_file_path}")
+
+    encoded_data = encode_data(palette, version)
 
     encoded_file_path = Path(png_file_path.parent, png_file_path.name.replace(".png", ".dmp"))
 
@@ -90,6 +195,25 @@ def encode(png_file_path, version, timestamp_manager, save_to_file=True):
     
     return palette
 
+def verify(encoded_file_path, version):
+    encoded_file = open(encoded_file_path, 'rb')
+    encoded_data = encoded_file.read()
+    encoded_file.close()
+
+    palette = decode_data(encoded_data, version)
+    reencoded_palette = decode_data(bytes(encode_data(palette, version)), version)
+
+    if len(reencoded_palette) != len(palette):
+        return [f"{len(palette)} colors became {len(reencoded_palette)}"]
+    
+    mismatches = []
+
+    for i in range(len(palette)):
+        if reencoded_palette[i] != palette[i]:
+            mismatches.append(f"color {i}")
+    
+    return mismatches
+
 if __name__ == "__main__":
     if sys.argv[1] == 'decode':
         decode(Path(sys.argv[2]).resolve(), sys.argv[3], [], True)
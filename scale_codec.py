@@ -1,5 +1,6 @@
 import sys, os, json, timestamp_manager
 from binary_functions import *
+from file_writer import file_writer
 from pathlib import Path
 
 def decode_scale_data(data):
@@ -31,6 +32,28 @@ def encode_scale_data(table):
     
     return data
 
+def decode_data(scale_data, version):
+    scale_table = []
+
+    if version == '4':
+        scale_table = decode_scale_data(scale_data[6:])
+    elif version == '5':
+        scale_table = decode_scale_data(scale_data[8:])
+    
+    return scale_table
+
+def encode_data(scale_table, version):
+    scale_data = encode_scale_data(scale_table)
+
+    header = []
+
+    if version == '4':
+        header = le_encode(len(scale_data) + 6, 4) + [0x53, 0x41]
+    elif version == '5':
+        header = [0x53, 0x43, 0x41, 0x4c] + be_encode(len(scale_data) + 8, 4)
+    
+    return header + scale_data
+
 def decode(scale_data_file_path, version, timestamp_manager):
     print(f"Decoding {scale_data_file_path}")
 
@@ -38,20 +61,10 @@ def decode(scale_data_file_path, version, timestamp_manager):
     scale_data = scale_data_file.read()
     scale_data_file.close()
 
-    scale_table = []
-
-    if version == '4':
-        scale_table = decode_scale_data(scale_data[6:])
-    elif version == '5':
-        scale_table = decode_scale_data(scale_data[8:])
+    scale_table = decode_data(scale_data, version)
 
     scale_table_file_path = Path(scale_data_file_path.parent, scale_data_file_path.name.replace(".dmp", ".json"))
-    scale_table_file = open(scale_table_file_path, 'w')
-    scale_table_file.write(json.dumps(scale_table, indent=4))
-    scale_table_file.close()
-
-    if timestamp_manager != []:
-        timestamp_manager.add_timestamp(scale_table_file_path)
+    file_writer.save_text(json.dumps(scale_table, indent=4), scale_table_file_path, timestamp_manager)
 
 def encode(scale_table_file_path, version, timestamp_manager):
     print(f"Encoding {scale_table_file_path}")
@@ -60,16 +73,7 @@ def encode(scale_table_file_path, version, timestamp_manager):
     scale_table = json.loads(scale_table_file.read())
     scale_table_file.close()
 
-    scale_data = encode_scale_data(scale_table)
-
-    header = []
-
-    if version == '4':
-        header = le_encode(len(scale_data) + 6, 4) + [0x53, 0x41]
-    elif version == '5':
-        header = [0x53, 0x43, 0x41, 0x4c] + be_encode(len(scale_data) + 8, 4)
-    
-    scale_data = header + scale_data
+    scale_data = encode_data(scale_table, version)
 
     scale_data_file_path = Path(scale_table_file_path.parent, scale_table_file_path.name.replace(".json", ".dmp"))
     scale_data_file = open(scale_data_file_path, 'wb')
@@ -79,6 +83,25 @@ def encode(scale_table_file_path, version, timestamp_manager):
     if timestamp_manager != []:
         timestamp_manager.add_timestamp(scale_table_file_path)
 
+def verify(scale_data_file_path, version):
+    scale_data_file = open(scale_data_file_path, 'rb')
+    scale_data = scale_data_file.read()
+    scale_data_file.close()
+
+    scale_table = decode_data(scale_data, version)
+    reencoded_table = decode_data(bytes(encode_data(scale_table, version)), version)
+
+    if len(reencoded_table) != len(scale_table):
+        return [f"{len(scale_table)} entries became {len(reencoded_table)}"]
+    
+    mismatches = []
+
+    for i in range(len(scale_table)):
+        if reencoded_table[i] != scale_table[i]:
+            mismatches.append(f"entry {i}")
+    
+    return mismatches
+
 if __name__ == "__main__":
     if sys.argv[1] == 'decode':
         decode(Path(sys.argv[2]).resolve(), sys.argv[3], [])
@@ -1,5 +1,6 @@
 import os, sys, re, json, timestamp_manager
 from subprocess import run
+from file_writer import file_writer
 from pathlib import Path
 
 python_scripts_path = Path(__file__).resolve().parent
@@ -142,12 +143,7 @@ def decode(bytecode_file_path, version, timestamp_manager):
         elif version == '5':
             script_file_path = Path(script_file_path.parent, script_file_path.name.replace("SCRP_", "_SCRP_"))
     
-    script_file = open(script_file_path, 'w')
-    script_file.write(script)
-    script_file.close()
-
-    if timestamp_manager != []:
-        timestamp_manager.add_timestamp(script_file_path)
+    file_writer.save_text(script, script_file_path, timestamp_manager)
         
 def prepare_special_characters(script):
     script = script.replace("\\xFA", " ")#.replace("...\"", "^^\"").replace("...", "^")
@@ -1,7 +1,8 @@
 import os, sys, re, json, time, math
 from timestamp_manager import *
 from pathlib import Path
-import script_codec, box_codec, scale_codec, palette_codec, image_codec, costume_codec
+from concurrent.futures import ProcessPoolExecutor
+import script_codec, box_codec, scale_codec, palette_codec, image_codec, costume_codec, file_writer, size_report
 
 python_scripts_path = Path(__file__).resolve().parent
 tools_path = Path(python_scripts_path, "Tools", "JestarJokin")
@@ -246,6 +247,61 @@ class FileCrawlerBuild(FileCrawler):
     def process_folder(self, folder_path, folder_type):
         return
 
+class FileCrawlerVerify(FileCrawler):
+    verification_tasks = []
+
+    def __init__(self, version, video_type, file_types_to_target, timestamp_manager):
+        super().__init__(version, video_type, file_types_to_target, timestamp_manager)
+        self.verification_tasks = []
+    
+    def process_file(self, file_path):
+        if identify_file_status(file_path.name) != "binary":
+            return
+        
+        file_type = ""
+        if self.version == '4':
+            file_type = identify_file_type_v4(file_path.name)
+        elif self.version == '5':
+            file_type = identify_file_type_v5(file_path.name)
+        
+        if file_type == "palette":
+            self.room_palette = palette_codec.decode(file_path, self.version, [], False)
+            self.room_palette_found = True
+
+        if not file_type in self.file_types_to_target:
+            return
+        
+        if file_type in ["image", "costume"] and self.video_type == 'vga' and not self.room_palette_found:
+            self.palette_dependent_queue.append(file_path)
+            return
+        
+        self.verification_tasks.append((file_type, file_path, self.version, self.video_type, self.room_palette))
+
+    def process_folder(self, folder_path, folder_type):
+        return
+
+def verify_file(verification_task):
+    (file_type, file_path, version, video_type, room_palette) = verification_task
+
+    start_time = time.time()
+
+    mismatches = []
+
+    if file_type == "image":
+        mismatches = image_codec.verify(file_path, version, video_type, room_palette)
+    elif file_type == "zplane":
+        mismatches = image_codec.verify(file_path, version, 'zplane')
+    elif file_type == "costume":
+        mismatches = costume_codec.verify(file_path, version, video_type, room_palette)
+    elif file_type == "box":
+        mismatches = box_codec.verify(file_path, version)
+    elif file_type == "scale":
+        mismatches = scale_codec.verify(file_path, version)
+    elif file_type == "palette":
+        mismatches = palette_codec.verify(file_path, version)
+    
+    return (file_type, file_path, file_path.stat().st_size, time.time() - start_time, mismatches)
+
 def add_room_names(decomp_path, game_id):
     room_root_paths = []
 
@@ -290,6 +346,15 @@ def add_room_names(decomp_path, game_id):
             os.rename(room_path, new_room_path)
 
 
+def get_flag_value(flags, flag_name, default_value):
+    for i in range(len(flags)):
+        if flags[i] == flag_name and i + 1 < len(flags):
+            return flags[i + 1]
+        elif flags[i].startswith(flag_name + "="):
+            return flags[i][len(flag_name) + 1:]
+    
+    return default_value
+
 def decompile(game_path, decomp_path, game_id, flags):
     game_id = game_id.upper()
 
@@ -314,6 +379,14 @@ def decompile(game_path, decomp_path, game_id, flags):
     #file_types_to_decode = ["costume", "script", "image", "scale", "box", "palette", "zplane"]
     file_types_to_decode = ["box"]
 
+    image_codec.paletted_png = "--paletted-png" in flags
+    costume_codec.paletted_png = "--paletted-png" in flags
+    costume_codec.packed_spritesheets = "--packed-spritesheets" in flags
+
+    file_writer.png_compression_level = int(get_flag_value(flags, "--png-level", "6"))
+    write_threads = int(get_flag_value(flags, "--write-threads", "4"))
+    file_writer.file_writer.start(write_threads, 4 * write_threads)
+
     timestamp_manager = TimestampManager(decomp_path)
 
     timestamp_manager.check_for_existing_timestamps()
@@ -321,6 +394,9 @@ def decompile(game_path, decomp_path, game_id, flags):
     file_crawler = FileCrawlerDecomp(version, video_type, file_types_to_decode, timestamp_manager)
     file_crawler.crawl_folder(decomp_path)
 
+    # timestamps of files still being written are only added once they're done
+    file_writer.file_writer.finish()
+
     timestamp_manager.save_to_timestamp_file()
 
     end_time = time.time()
@@ -343,27 +419,231 @@ def build(decomp_path, game_path, game_id, flags):
     
     file_types_to_encode = ["costume", "script", "image", "scale", "box", "palette", "zplane"]
 
+    image_codec.reuse_previous_stripes = not "--no-stripe-passthrough" in flags
+    image_codec.stripe_cache.disk_path = get_flag_value(flags, "--stripe-cache", "")
+    image_codec.dedupe_stripes = "--dedupe-stripes" in flags
+    costume_codec.dedupe_picts = "--dedupe-picts" in flags
+    costume_codec.reuse_cached_picts = not "--no-pict-cache" in flags
+    palette_codec.quantize_mode = get_flag_value(flags, "--quantize", "exact")
+    assert palette_codec.quantize_mode in palette_codec.quantize_modes
+    image_codec.optimal_ega_encoding = not "--fast-ega" in flags
+
+    jobs = int(get_flag_value(flags, "--jobs", "1"))
+    if jobs > 1:
+        image_codec.stripe_pool = ProcessPoolExecutor(jobs)
+        image_codec.stripe_pool_size = jobs
+
     timestamp_manager = TimestampManager(decomp_path)
     timestamp_manager.check_for_existing_timestamps()
 
+    size_report_path = get_flag_value(flags, "--size-report", "")
+    size_report.size_report.enabled = size_report_path != ""
+    size_report.growth_threshold = float(get_flag_value(flags, "--growth-threshold", "5"))
+
     file_crawler = FileCrawlerBuild(version, video_type, file_types_to_encode, timestamp_manager)
     file_crawler.crawl_folder(decomp_path)
 
+    if image_codec.stripe_pool is not None:
+        image_codec.stripe_pool.shutdown()
+        image_codec.stripe_pool = None
+
+    if size_report_path != "":
+        size_report.size_report.save(Path(size_report_path).resolve(), decomp_path)
+
+    if palette_codec.quantized_pixel_count > 0:
+        print(f"{palette_codec.quantized_pixel_count} off-palette pixels were quantized to the nearest palette colors")
+
     if not timestamp_manager.changes_found:
         print("Nothing to rebuild")
         return
     
+    pack_game(decomp_path, game_path, game_id)
+
+    timestamp_manager.save_to_timestamp_file()
+
+    end_time = time.time()
+    total_time = end_time - start_time
+    
+    print(f"{game_id} successfully built in {math.floor(total_time)} seconds")
+
+def pack_game(decomp_path, game_path, game_id):
     if os.name == 'posix':
         os.system(f'python2 {scummpacker_py2_path} -g {game_id} -i "{decomp_path}" -o {game_path} -p')
     elif os.name == 'nt':
         os.system(f'{scummpacker_exe_path} -g {game_id} -i "{decomp_path}" -o {game_path} -p')
 
+def parse_color_mapping(color_mapping, palette_size):
+    # "12:40,13:41" sends palette index 12 to 40 and 13 to 41, leaving every other index alone
+    color_table = bytearray(range(256))
+
+    for color_pair in color_mapping.split(","):
+        (source_index, target_index) = color_pair.split(":")
+
+        source_index = int(source_index, 0)
+        target_index = int(target_index, 0)
+        assert 0 <= source_index < palette_size and 0 <= target_index < palette_size
+
+        color_table[source_index] = target_index
+    
+    return bytes(color_table)
+
+def has_unbuilt_changes(decomp_path, version, timestamp_manager):
+    # remapping decodes images and costumes again, which would overwrite any edits that haven't been built yet
+    changed_file_paths = []
+
+    for file_path in sorted(decomp_path.rglob("*")):
+        if not file_path.is_file() or identify_file_status(file_path.name) != "decoded":
+            continue
+
+        file_type = ""
+        if version == '4':
+            file_type = identify_file_type_v4(file_path.name)
+        elif version == '5':
+            file_type = identify_file_type_v5(file_path.name)
+        
+        if file_type in ["image", "zplane", "costume"] and timestamp_manager.check_timestamp(file_path):
+            changed_file_paths.append(file_path)
+    
+    for file_path in changed_file_paths:
+        print(f"Error: {file_path} has changes that haven't been built yet")
+    
+    if len(changed_file_paths) > 0:
+        print("Build the game before remapping it")
+        return True
+    
+    return False
+
+def remap(decomp_path, game_path, game_id, color_mapping, flags):
+    game_id = game_id.upper()
+    assert game_id in supported_games
+
+    version = version_table[game_id]
+    video_type = video_table[game_id]
+
+    start_time = time.time()
+
+    decomp_path = Path(decomp_path).resolve()
+    game_path = Path(game_path).resolve()
+
+    scope_path = Path(decomp_path, get_flag_value(flags, "--scope", "")).resolve()
+    assert scope_path.is_dir()
+
+    # ega images and costumes only have room for the 16 ega colors, while vga rooms have a full 256 color palette
+    palette_size = 256
+    if video_type == 'ega':
+        palette_size = len(image_codec.ega_palette)
+
+    color_table = parse_color_mapping(color_mapping, palette_size)
+
+    image_codec.dedupe_stripes = "--dedupe-stripes" in flags
+    image_codec.optimal_ega_encoding = not "--fast-ega" in flags
+
+    # the decoded files are written again the same way decompile wrote them
+    image_codec.paletted_png = "--paletted-png" in flags
+    costume_codec.paletted_png = "--paletted-png" in flags
+    costume_codec.packed_spritesheets = "--packed-spritesheets" in flags
+    file_writer.png_compression_level = int(get_flag_value(flags, "--png-level", "6"))
+
+    timestamp_manager = TimestampManager(decomp_path)
+    timestamp_manager.check_for_existing_timestamps()
+
+    if has_unbuilt_changes(decomp_path, version, timestamp_manager):
+        return
+
+    remapped_stripe_count = 0
+    remapped_image_count = 0
+    remapped_costume_count = 0
+
+    for file_path in sorted(scope_path.rglob("*.dmp")):
+        file_type = ""
+        if version == '4':
+            file_type = identify_file_type_v4(file_path.name)
+        elif version == '5':
+            file_type = identify_file_type_v5(file_path.name)
+        
+        # the decoded files are refreshed from the remapped data, so the next build has nothing to redo
+        if file_type == "image":
+            stripe_count = image_codec.remap(file_path, version, video_type, color_table)
+
+            if stripe_count > 0:
+                image_codec.decode(file_path, version, timestamp_manager, video_type)
+                remapped_stripe_count += stripe_count
+                remapped_image_count += 1
+
+        elif file_type == "costume":
+            if costume_codec.remap(file_path, version, video_type, color_table) > 0:
+                costume_codec.decode(file_path, version, timestamp_manager, video_type)
+                remapped_costume_count += 1
+    
+    if remapped_image_count == 0 and remapped_costume_count == 0:
+        print("Nothing to remap")
+        return
+    
+    pack_game(decomp_path, game_path, game_id)
+
     timestamp_manager.save_to_timestamp_file()
 
     end_time = time.time()
     total_time = end_time - start_time
+
+    print(f"Remapped {remapped_stripe_count} stripes in {remapped_image_count} images and the palettes of {remapped_costume_count} costumes in {math.floor(total_time)} seconds")
+
+def verify(decomp_path, game_id, flags):
+    game_id = game_id.upper()
+    assert game_id in supported_games
+
+    version = version_table[game_id]
+    video_type = video_table[game_id]
+
+    start_time = time.time()
+
+    decomp_path = Path(decomp_path).resolve()
+
+    file_types_to_verify = ["costume", "image", "scale", "box", "palette", "zplane"]
+
+    file_crawler = FileCrawlerVerify(version, video_type, file_types_to_verify, [])
+    file_crawler.crawl_folder(decomp_path)
+
+    jobs = int(get_flag_value(flags, "--jobs", str(os.cpu_count())))
+
+    results = []
+    with ProcessPoolExecutor(jobs) as pool:
+        results = list(pool.map(verify_file, file_crawler.verification_tasks, chunksize=4))
+
+    codec_stats = {}
+    mismatch_count = 0
+
+    for (file_type, file_path, file_size, verify_time, mismatches) in results:
+        if not file_type in codec_stats:
+            codec_stats[file_type] = [0, 0, 0, 0]
+        
+        stats = codec_stats[file_type]
+        stats[0] += 1
+        stats[1] += file_size
+        stats[2] += verify_time
+        stats[3] += len(mismatches)
+
+        for mismatch in mismatches:
+            print(f"Mismatch in {file_path.relative_to(decomp_path)}: {mismatch}")
+        
+        mismatch_count += len(mismatches)
     
-    print(f"{game_id} successfully built in {math.floor(total_time)} seconds")
+    # throughput is per process, as the times are added up across all of them
+    for file_type in sorted(codec_stats):
+        (file_count, total_size, total_time, codec_mismatch_count) = codec_stats[file_type]
+        megabytes = total_size / 1000000
+        speed = megabytes / max(total_time, 0.000001)
+
+        print(f"{file_type}: {file_count} files, {megabytes:.2f} MB at {speed:.2f} MB/s, {codec_mismatch_count} mismatches")
+
+    end_time = time.time()
+    total_time = end_time - start_time
+
+    if mismatch_count > 0:
+        print(f"{game_id} failed verification with {mismatch_count} mismatches in {math.floor(total_time)} seconds")
+        exit(1)
+
+    print(f"{game_id} successfully verified in {math.floor(total_time)} seconds")
 
 
 if __name__ == "__main__":
@@ -373,4 +653,10 @@ if __name__ == "__main__":
     elif sys.argv[1] == "build":
         build(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5:])
 
+    elif sys.argv[1] == "verify":
+        verify(sys.argv[2], sys.argv[3], sys.argv[4:])
+
+    elif sys.argv[1] == "remap":
+        remap(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6:])
+
 
@@ -0,0 +1,142 @@
+import json
+from pathlib import Path
+
+growth_threshold = 5.0
+
+def get_growth_percent(original_size, new_size):
+    if original_size is None or original_size == 0:
+        return None
+
+    return (new_size - original_size) * 100 / original_size
+
+def get_room_name(relative_path):
+    for path_part in relative_path.parts[:-1]:
+        if path_part.startswith("LFLF_") or path_part.startswith("LF_"):
+            return path_part
+
+    if len(relative_path.parts) > 1:
+        return relative_path.parts[0]
+
+    return "."
+
+def format_size_change(original_size, new_size):
+    growth_percent = get_growth_percent(original_size, new_size)
+
+    if growth_percent is None:
+        return "new"
+
+    return f"{growth_percent:+.1f}%"
+
+def format_details(asset):
+    if "stripe_variant_counts" in asset:
+        variant_counts = sorted(asset["stripe_variant_counts"].items(), key = lambda item: -item[1])
+        return ", ".join([f"{variant} x{count}" for (variant, count) in variant_counts])
+
+    if "pict_count" in asset:
+        original_pict_data_size = asset["original_pict_data_size"]
+        if original_pict_data_size is None:
+            original_pict_data_size = "-"
+
+        return f"{asset['pict_count']} picts, RLE {original_pict_data_size} -> {asset['pict_data_size']}"
+
+    return ""
+
+class SizeReport:
+    enabled = False
+    assets = []
+
+    def __init__(self):
+        self.enabled = False
+        self.assets = []
+
+    def add_asset(self, file_path, asset_type, original_size, new_size, details):
+        asset = {
+            "path": file_path,
+            "type": asset_type,
+            "original_size": original_size,
+            "new_size": new_size
+        }
+        asset.update(details)
+
+        self.assets.append(asset)
+
+    def build_report(self, decomp_path):
+        rooms = {}
+        flagged_assets = []
+
+        total_original_size = 0
+        total_new_size = 0
+
+        for asset in self.assets:
+            relative_path = Path(asset["path"]).relative_to(decomp_path)
+            room_name = get_room_name(relative_path)
+
+            if not room_name in rooms:
+                rooms[room_name] = {
+                    "original_size": 0,
+                    "new_size": 0,
+                    "assets": []
+                }
+
+            growth_percent = get_growth_percent(asset["original_size"], asset["new_size"])
+            flagged = growth_percent is not None and growth_percent > growth_threshold
+
+            room_asset = dict(asset)
+            room_asset["path"] = relative_path.as_posix()
+            room_asset["growth_percent"] = growth_percent
+            room_asset["flagged"] = flagged
+
+            room = rooms[room_name]
+            room["assets"].append(room_asset)
+
+            # new files have nothing to compare against, so they're left out of the totals
+            if asset["original_size"] is not None:
+                room["original_size"] += asset["original_size"]
+                room["new_size"] += asset["new_size"]
+                total_original_size += asset["original_size"]
+                total_new_size += asset["new_size"]
+
+            if flagged:
+                flagged_assets.append(room_asset["path"])
+
+        return {
+            "growth_threshold": growth_threshold,
+            "original_size": total_original_size,
+            "new_size": total_new_size,
+            "flagged": flagged_assets,
+            "rooms": rooms
+        }
+
+    def save(self, report_path, decomp_path):
+        report = self.build_report(decomp_path)
+
+        report_file = open(report_path, 'w')
+        report_file.write(json.dumps(report, indent = 4))
+        report_file.close()
+
+        self.print_table(report)
+
+    def print_table(self, report):
+        print(f"{'':2}{'Asset':<40} {'Type':<14} {'Original':>9} {'New':>9} {'Change':>8}  Details")
+
+        for (room_name, room) in sorted(report["rooms"].items()):
+            print(f"{'':2}{room_name:<40} {'':<14} {room['original_size']:>9} {room['new_size']:>9} {format_size_change(room['original_size'], room['new_size']):>8}")
+
+            for asset in room["assets"]:
+                marker = "!" if asset["flagged"] else ""
+
+                original_size = asset["original_size"]
+                if original_size is None:
+                    original_size = "-"
+
+                # the room is already in the heading, so only the rest of the path is shown
+                asset_path = asset["path"].split(room_name + "/", 1)[-1]
+
+                print(f"{marker:<2}  {asset_path:<38} {asset['type']:<14} {original_size:>9} {asset['new_size']:>9} {format_size_change(asset['original_size'], asset['new_size']):>8}  {format_details(asset)}")
+
+        print(f"Total: {report['original_size']} -> {report['new_size']} bytes ({format_size_change(report['original_size'], report['new_size'])})")
+
+        if len(report["flagged"]) > 0:
+            print(f"{len(report['flagged'])} assets grew by more than {report['growth_threshold']}%, marked with !")
+
+size_report = SizeReport()
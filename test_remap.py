@@ -0,0 +1,43 @@
+import pytest
+import scummpiler
+
+def test_color_mapping_sends_only_listed_indices():
+    color_table = scummpiler.parse_color_mapping("12:40,0x0d:41", 256)
+
+    assert color_table[12] == 40
+    assert color_table[13] == 41
+    assert color_table[14] == 14
+
+def test_color_mapping_outside_ega_palette_is_refused():
+    with pytest.raises(AssertionError):
+        scummpiler.parse_color_mapping("0:40", 16)
+
+    with pytest.raises(AssertionError):
+        scummpiler.parse_color_mapping("16:0", 16)
+
+def test_ega_remap_outside_ega_palette_leaves_files_alone(tmp_path):
+    room_path = tmp_path / "LF_0001"
+    room_path.mkdir()
+
+    costume_data = bytes(range(24))
+    (room_path / "CO_0001.dmp").write_bytes(costume_data)
+
+    with pytest.raises(AssertionError):
+        scummpiler.remap(tmp_path, tmp_path / "game", "MI1EGA", "0:40", [])
+    
+    assert (room_path / "CO_0001.dmp").read_bytes() == costume_data
+
+def test_remap_waits_for_unbuilt_changes(tmp_path):
+    room_path = tmp_path / "LFLF_0001"
+    room_path.mkdir()
+
+    spritesheet_path = room_path / "_COST_0001_spritesheet.png"
+    spritesheet_path.write_bytes(b"")
+
+    timestamp_manager = scummpiler.TimestampManager(tmp_path)
+
+    assert scummpiler.has_unbuilt_changes(tmp_path, '5', timestamp_manager)
+
+    timestamp_manager.add_timestamp(spritesheet_path)
+
+    assert not scummpiler.has_unbuilt_changes(tmp_path, '5', timestamp_manager)